@@ -0,0 +1,174 @@
+"""
+Latency of gdb commands, by command verb (-var-create, -exec-next, ...).
+
+Each command is timed at the points it goes through, matched by its MI token :
+	sent : the command is handed to the controller
+	written : it is written to gdb's stdin
+	first byte : the output chunk holding its result record is read
+	parsed : its result record is parsed
+	done : its response handler returns (or, without a handler, when it is parsed)
+The time between two consecutive points is a phase, recorded in a histogram per verb :
+	queue (sent -> written), gdb (written -> first byte), parse (first byte -> parsed),
+	handler (parsed -> done), and total (sent -> done).
+"""
+import math
+import json
+import time
+import threading
+
+PHASES = [ 'queue', 'gdb', 'parse', 'handler', 'total' ]
+
+class Histogram(object):
+	"""
+	Counts durations in buckets of powers of 2 microseconds.
+	"""
+	def __init__(self):
+		self.buckets = {} # k -> number of durations in ]2^(k-1), 2^k] us
+		self.count = 0
+		self.sum = 0.
+		self.min = None
+		self.max = None
+
+	def add(self, seconds):
+		us = max(seconds * 1e6, 0.)
+		k = 0
+		if us > 1.:
+			mantissa, k = math.frexp(us) # us = mantissa * 2^k, .5 <= mantissa < 1
+			if mantissa == .5:
+				k -= 1
+		self.buckets[k] = self.buckets.get(k, 0) + 1
+		self.count += 1
+		self.sum += us
+		if self.min is None or us < self.min:
+			self.min = us
+		if self.max is None or us > self.max:
+			self.max = us
+
+	def percentile(self, p):
+		"""
+		Return an upper bound of the p-th percentile, in microseconds.
+		"""
+		if not self.count:
+			return None
+		rank = p / 100. * self.count
+		seen = 0
+		for k in sorted(self.buckets):
+			seen += self.buckets[k]
+			if seen >= rank:
+				return min(2. ** k, self.max)
+		return self.max
+
+	def to_dict(self):
+		return {
+			'count': self.count,
+			'mean_us': self.sum / self.count if self.count else None,
+			'min_us': self.min,
+			'max_us': self.max,
+			'p50_us': self.percentile(50),
+			'p90_us': self.percentile(90),
+			'p99_us': self.percentile(99),
+			'buckets': dict(('%d' % 2 ** k, n) for k, n in self.buckets.iteritems()),
+		}
+
+def command_verb(command):
+	words = command.split(None, 1)
+	return words[0] if words else ''
+
+class CommandStats(object):
+	"""
+	Records the timing of the commands in flight, and the latency histograms of the completed ones.
+	Timing points may be recorded from any thread.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.inflight = {} # token -> [verb, sent, written, first byte, parsed]
+		self.histograms = {} # verb -> phase -> Histogram
+		self.errors = {} # verb -> number of ^error responses
+
+	def sent(self, token, command):
+		with self.lock:
+			self.inflight[str(token)] = [ command_verb(command), time.time(), None, None, None ]
+
+	def written(self, records):
+		"""
+		Record the write times reported by the CommandWriter, as (token, enqueue time, write time).
+		"""
+		with self.lock:
+			for token, enqueued, written in records:
+				timing = self.inflight.get(str(token))
+				if timing is not None:
+					timing[2] = written
+
+	def parsed(self, token, first_byte, error = False):
+		with self.lock:
+			timing = self.inflight.get(token)
+			if timing is None or timing[4] is not None:
+				return
+			timing[3] = first_byte
+			timing[4] = time.time()
+			if error:
+				self.errors[timing[0]] = self.errors.get(timing[0], 0) + 1
+
+	def done(self, token, end = None):
+		"""
+		Record that the command is complete : at `end`, or now.
+		"""
+		now = end or time.time()
+		with self.lock:
+			timing = self.inflight.pop(token, None)
+			if timing is None or timing[4] is None:
+				return
+			verb, sent, written, first_byte, parsed = timing
+			if written is None:
+				# written without going through the writer's accounting
+				written = sent
+			phases = self.histograms.get(verb)
+			if phases is None:
+				phases = self.histograms[verb] = dict((phase, Histogram()) for phase in PHASES)
+			phases['queue'].add(written - sent)
+			phases['gdb'].add(first_byte - written)
+			phases['parse'].add(parsed - first_byte)
+			phases['handler'].add(now - parsed)
+			phases['total'].add(now - sent)
+
+	def to_dict(self):
+		"""
+		Return the histograms, as verb -> { phase -> histogram dict, 'errors' -> count }.
+		"""
+		with self.lock:
+			result = {}
+			for verb, phases in self.histograms.iteritems():
+				result[verb] = dict((phase, hist.to_dict()) for phase, hist in phases.iteritems())
+				result[verb]['errors'] = self.errors.get(verb, 0)
+			return result
+
+	def dump_json(self, out):
+		"""
+		Write the histograms as JSON to a file name or a file object.
+		"""
+		if isinstance(out, basestring):
+			f = open(out, 'w')
+			try:
+				json.dump(self.to_dict(), f, indent = 1, sort_keys = True)
+			finally:
+				f.close()
+		else:
+			json.dump(self.to_dict(), out, indent = 1, sort_keys = True)
+
+	def report(self):
+		"""
+		Return a table of the median and 99th percentile of each phase, by verb.
+		"""
+		lines = [ '%-28s %7s  %s' % ('command', 'count', '  '.join('%15s' % ('%s p50/p99' % phase) for phase in PHASES)) ]
+		stats = self.to_dict()
+		for verb in sorted(stats):
+			phases = stats[verb]
+			cells = [ '%7.0f/%-7.0f' % (phases[phase]['p50_us'], phases[phase]['p99_us']) for phase in PHASES ]
+			lines.append('%-28s %7d  %s' % (verb, phases['total']['count'], '  '.join(cells)))
+		return '\n'.join(lines)
+
+	def reset(self):
+		with self.lock:
+			self.histograms = {}
+			self.errors = {}
@@ -0,0 +1,141 @@
+import os
+import time
+import errno
+import threading
+
+class CommandWriter(object):
+	"""
+	Writes command lines to gdb's stdin, from any number of threads.
+
+	Each line is queued, and the queue is written with a single os.write().
+	The first thread to queue a line while nobody is writing does the write itself, right away ;
+	lines queued by other threads during that write are written by the same thread, in one write,
+	before it returns. So a line is written as soon as the pipe allows, and lines queued
+	at the same time share a system call.
+
+	write() returns once the line is queued ; flush() returns once everything queued before it is written.
+
+	on_write, if given, is called right before each write with the list of (key, enqueue time, write time)
+	of the lines written, key being what was passed to write() (eg. the command token).
+
+	The writer must be closed before its stream : once close() returns, nothing is written to the
+	file descriptor, which may then be reused. Writing to a closed writer raises ValueError.
+	"""
+
+	def __init__(self, stream, on_write = None):
+		self.stream = stream
+		self.fd = stream.fileno()
+		self.on_write = on_write
+		self.cond = threading.Condition()
+		self.queue = [] # (line, key, enqueue time)
+		self.writing = False
+		self.closed = False
+		self.queued = 0 # number of lines ever queued
+		self.written = 0 # number of lines ever written (or lost to a write error)
+		# counters
+		self.nwrites = 0
+		self.nbytes = 0
+
+	def write(self, line, key = None):
+		"""
+		Queue a line (without its end of line) and write it unless another thread is writing.
+		"""
+		self.write_lines([ line ], [ key ])
+
+	def write_lines(self, lines, keys = None):
+		if keys is None:
+			keys = [ None ] * len(lines)
+		now = time.time()
+		with self.cond:
+			self._check_open()
+			for line, key in zip(lines, keys):
+				self.queue.append((line, key, now))
+			self.queued += len(lines)
+			if self.writing:
+				# the writing thread takes them before it is done
+				return
+			self.writing = True
+		self._write_queue()
+
+	def _write_queue(self):
+		try:
+			while True:
+				with self.cond:
+					entries, self.queue = self.queue, []
+					if not entries or self.closed or self.stream.closed:
+						# closed : the lines left are dropped
+						self.written += len(entries)
+						self.writing = False
+						self.cond.notifyAll()
+						return
+				if self.on_write is not None:
+					# before the write : gdb may answer before os.write() returns
+					now = time.time()
+					self.on_write([ (key, t, now) for line, key, t in entries ])
+				try:
+					self._write_all("".join("%s\n" % line for line, key, t in entries))
+				finally:
+					with self.cond:
+						self.written += len(entries)
+						self.cond.notifyAll()
+		except:
+			with self.cond:
+				# lines queued meanwhile are left to the next writer
+				self.writing = False
+				self.cond.notifyAll()
+			raise
+
+	def _write_all(self, data):
+		while data:
+			try:
+				n = os.write(self.fd, data)
+			except OSError, err:
+				if err.errno == errno.EINTR:
+					continue
+				raise
+			data = data[n:]
+			self.nbytes += n
+		self.nwrites += 1
+
+	def _check_open(self):
+		# with self.cond held
+		if self.closed or self.stream.closed:
+			raise ValueError("CommandWriter is closed")
+
+	def close(self):
+		"""
+		Stop writing : wait for the write in progress, if any, and drop the lines still queued.
+		"""
+		with self.cond:
+			self.closed = True
+			while self.writing:
+				self.cond.wait()
+			self.written += len(self.queue)
+			self.queue = []
+			self.cond.notifyAll()
+
+	def flush(self):
+		"""
+		Wait until the lines queued so far are written (or dropped by close()).
+		"""
+		with self.cond:
+			target = self.queued
+			while self.written < target:
+				if not self.writing:
+					# left over by a failed write : write them here
+					self.writing = True
+					self.cond.release()
+					try:
+						self._write_queue()
+					finally:
+						self.cond.acquire()
+					continue
+				self.cond.wait()
+
+	def stats(self):
+		with self.cond:
+			return {
+				'lines': self.written,
+				'writes': self.nwrites,
+				'bytes': self.nbytes,
+			}
@@ -1,4 +1,5 @@
 from recparse import *
+from recparse_codegen import CompiledParser
 """
 Grossly simplified parser for C++ type specifications, for parsing
 type info as output by gdb.
@@ -84,6 +85,8 @@ ptr_operator      = (lex.STAR | lex.AMPERSAND) + cv_qualifier * (0,)
 type << (cv_qualifier | specifier) * (0,) + scoped_type + ptr_operator * (0,)
 type.set_result(lambda tok,val: CppType(val[1][-1], val[1][:-1], val[0], sum(val[2], []) ))
 
+compiled_type = CompiledParser(type, 'cpptype')
+
 
 def parse_cpptype(inputstr):
 	
@@ -92,7 +95,7 @@ def parse_cpptype(inputstr):
 	toks = list(tokens.unconsumed)
 	tokstream = TokenStream(iter(toks))
 
-	success, result = type.try_parse(tokstream)
+	success, result = compiled_type.try_parse(tokstream)
 	
 	if success:
 		return result
@@ -238,4 +238,28 @@ class LogView(View):
 			self.win.addnstr(maxy - 1, 0, line, maxx)
 		self.win.refresh()
 
+class HistoryView(View):
+	"""
+	Shows the last lines of a LineHistory, as many as fit.
+	They are read back from the history on each redraw, so that they survive a resize.
+	"""
+
+	def __init__(self, history, curses_format = curses.A_NORMAL, parent = None, win = None):
+		View.__init__(self, parent, win)
+		self.history = history
+		self.curses_format = curses_format
+		self.drawn = None # length of the history when last drawn
+
+	def draw(self, force = False):
+		if self.win is None:
+			return
+		size = len(self.history)
+		if not force and size == self.drawn:
+			return
+		self.drawn = size
+		self.win.erase()
+		maxy, maxx = self.win.getmaxyx()
+		for y, line in enumerate(self.history.tail(maxy)):
+			self.win.addnstr(y, 0, line.rstrip('\r\n'), max(0, maxx - 1), self.curses_format)
+
 
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+"""
+A stand-in for gdb --interpreter=mi, to load-test the controller, session, watch and TUI layers
+without a compiler, a target program or gdb itself.
+
+It answers the commands it reads on stdin :
+	- from a transcript, the gdbin.log and gdbout.log files written by the cli and tui loggers :
+	  a command gets the answer it got when it was recorded, with its token changed
+	  (commands sent more than once get their answers in the recorded order, then the last one again) ;
+	  in process, the input_hist and output_hist of a GdbController serve as well (see Transcript.load) ;
+	- otherwise by synthesizing an answer, whose size is set on the command line :
+	  children lists, var update changelists, values, and target output on each step ;
+	- otherwise with an error.
+
+Answers are paced by --delay (a fixed wait before each one), --jitter (a random extra wait, up to
+that many seconds) and --rate (at most that many answers per second, like a gdb busy on a slow target).
+
+	python fake_gdb.py [--replay GDBIN GDBOUT] [--delay SECONDS] [--jitter SECONDS] [--rate N]
+		[--children N] [--changes N] [--value-size N] [--target-lines N] [--tty=TTY] [--interpreter=mi]
+
+GdbMI runs it in place of gdb :
+
+	GdbMI(gdb = [ sys.executable, 'fake_gdb.py', '--children', '10000' ])
+"""
+import os
+import re
+import sys
+import time
+import random
+from collections import deque
+from optparse import OptionParser
+
+PROMPT = '(gdb) \n'
+
+# ========== TRANSCRIPTS ==========
+
+# the timestamp prefix of log files written with the '%(created)f\t%(message)s' format
+TIMESTAMP_RE = re.compile(r'^[0-9]+\.[0-9]+\t')
+
+def read_log(source):
+	"""
+	Return the lines recorded in a gdbin.log or gdbout.log file,
+	or kept by a LineHistory (eg. the output_hist of a GdbController) when source is not a path.
+	Log records may be prefixed by a timestamp ; the blank lines added by the logger are dropped.
+	"""
+	if not isinstance(source, basestring):
+		return log_lines(source)
+	f = file(source, 'r')
+	try:
+		return log_lines(f)
+	finally:
+		f.close()
+
+def log_lines(records):
+	lines = []
+	for line in records:
+		line = TIMESTAMP_RE.sub('', line, 1)
+		if line.strip() != '':
+			lines.append(line.rstrip('\r\n') + '\n')
+	return lines
+
+COMMAND_RE = re.compile(r'([0-9]*)(.*)')
+RESULT_RE = re.compile(r'([0-9]+)\^')
+
+def is_stream_record(line):
+	return line[:1] in ('~', '@', '&')
+
+def has_token(line, token):
+	return line.startswith(token) and not line[len(token):len(token) + 1].isdigit()
+
+class Transcript(object):
+	"""
+	The answers of a recorded session, by command (without its token).
+
+	The output is cut at each result record : the answer of a command goes from its result record
+	to the next one, so that it includes the asynchronous records that follow (eg. the *stopped of -exec-next),
+	and starts with the stream records that precede its result record (eg. "Reading symbols from...").
+	"""
+
+	def __init__(self, commands, output):
+		self.banner = []
+		answers = {} # token -> lines
+		current = self.banner
+		for line in output:
+			m = RESULT_RE.match(line)
+			if m is not None and m.group(1) not in answers:
+				# the stream records just before the result record are part of its answer
+				start = len(current)
+				while start > 0 and is_stream_record(current[start - 1]):
+					start -= 1
+				lines = current[start:]
+				del current[start:]
+				current = answers[m.group(1)] = lines
+			current.append(line)
+		self.answers = {} # command -> deque of (recorded token, lines)
+		for line in commands:
+			token, command = COMMAND_RE.match(line.strip()).groups()
+			if token in answers:
+				self.answers.setdefault(command, deque()).append((token, answers[token]))
+
+	@classmethod
+	def load(cls, gdbin, gdbout):
+		"""
+		gdbin and gdbout are log files or LineHistory objects (see read_log).
+		"""
+		return cls(read_log(gdbin), read_log(gdbout))
+
+	def answer(self, command, token):
+		"""
+		Return the lines answering the command, or None if it was not recorded.
+		"""
+		recorded = self.answers.get(command)
+		if not recorded:
+			return None
+		if len(recorded) > 1:
+			old_token, lines = recorded.popleft()
+		else:
+			old_token, lines = recorded[0]
+		return [ token + line[len(old_token):] if has_token(line, old_token) else line for line in lines ]
+
+# ========== SYNTHETIC ANSWERS ==========
+
+def c_string(s):
+	return '"%s"' % s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def error(token, msg):
+	return [ '%s^error,msg=%s\n' % (token, c_string(msg)), PROMPT ]
+
+class Synthesizer(object):
+	"""
+	Makes up the answers to the common commands, of a given size.
+	"""
+
+	def __init__(self, children = 100, changes = 10, value_size = 8, target_lines = 0, tty = None):
+		self.children = children
+		self.changes = changes
+		self.value_size = value_size
+		self.target_lines = target_lines
+		self.tty = tty
+		self.nvars = 0
+		self.nbreakpoints = 0
+		self.line = 1
+
+	def value(self, name):
+		return c_string(('%s' % name * self.value_size)[:self.value_size])
+
+	def frame(self):
+		return 'frame={addr="0x08048428",func="main",args=[],file="fake.c",fullname="/fake/fake.c",line="%d"}' % self.line
+
+	# the arguments of the commands that cannot do without, as in gdb's usage errors
+	USAGE = {
+		'-var-create' : (3, "NAME FRAME EXPRESSION"),
+		'-var-list-children' : (1, "[PRINT_VALUES] NAME [FROM TO]"),
+		'-var-evaluate-expression' : (1, "[-f FORMAT] NAME"),
+		'-var-info-path-expression' : (1, "NAME"),
+		'-data-evaluate-expression' : (1, "EXPRESSION"),
+	}
+
+	def answer(self, command, token):
+		"""
+		Return the lines answering the command, or None for the commands it does not know.
+		"""
+		words = command.split()
+		if not words:
+			return None
+		verb, args = words[0], [ arg.strip('"') for arg in words[1:] ]
+		nargs, usage = self.USAGE.get(verb, (0, None))
+		if len(args) < nargs:
+			return error(token, "%s: Usage: %s." % (verb, usage))
+		name = args[-1] if args else ''
+		if verb == '-var-create':
+			self.nvars += 1
+			var = 'var%d' % self.nvars if args[0] == '-' else args[0]
+			return [ '%s^done,name="%s",numchild="%d",value=%s,type="int [%d]",thread-id="1",has_more="0"\n' % (
+				token, var, self.children, self.value(var), self.children), PROMPT ]
+		if verb == '-var-list-children':
+			children = ','.join('child={name="%s.%d",exp="%d",numchild="0",value=%s,type="int",thread-id="1"}' % (
+				name, i, i, self.value(i)) for i in xrange(self.children))
+			return [ '%s^done,numchild="%d",children=[%s],has_more="0"\n' % (token, self.children, children), PROMPT ]
+		if verb == '-var-evaluate-expression':
+			return [ '%s^done,value=%s\n' % (token, self.value(name)), PROMPT ]
+		if verb == '-var-info-path-expression':
+			return [ '%s^done,path_expr=%s\n' % (token, c_string('(%s)' % name)), PROMPT ]
+		if verb == '-var-update':
+			changes = ','.join('{name="var%d",value=%s,in_scope="true",type_changed="false",has_more="0"}' % (
+				i + 1, self.value(self.line + i)) for i in xrange(min(self.changes, self.nvars)))
+			return [ '%s^done,changelist=[%s]\n' % (token, changes), PROMPT ]
+		if verb == '-data-evaluate-expression':
+			return [ '%s^done,value=%s\n' % (token, self.value(name)), PROMPT ]
+		if verb == '-break-insert':
+			self.nbreakpoints += 1
+			return [ '%s^done,bkpt={number="%d",type="breakpoint",disp="keep",enabled="y",addr="0x08048428",'
+				'func="main",file="fake.c",fullname="/fake/fake.c",line="%s",times="0"}\n' % (token, self.nbreakpoints, name or '1'),
+				PROMPT ]
+		if verb in ('-exec-run', '-exec-next', '-exec-step', '-exec-continue', '-exec-finish', '-exec-until',
+				'-exec-next-instruction', '-exec-step-instruction'):
+			self.line += 1
+			self.write_target_output()
+			return [
+				'%s^running\n' % token,
+				'*running,thread-id="all"\n',
+				PROMPT,
+				'*stopped,reason="end-stepping-range",%s,thread-id="1",stopped-threads="all"\n' % self.frame(),
+				PROMPT,
+			]
+		if verb.startswith('-'):
+			return [ '%s^done\n' % token, PROMPT ]
+		return None
+
+	def write_target_output(self):
+		if self.tty is None or not self.target_lines:
+			return
+		data = ''.join('fake target output, line %d of step %d\n' % (i, self.line) for i in xrange(self.target_lines))
+		while data:
+			data = data[os.write(self.tty, data):]
+
+# ========== GDB ==========
+
+class FakeGdb(object):
+	"""
+	Answers the commands read on stdin, on stdout, after waiting `delay` seconds
+	plus a random time of up to `jitter` seconds, and no more than `rate` answers per second.
+	"""
+
+	def __init__(self, transcript = None, synthesizer = None, delay = 0., out = 1, jitter = 0., rate = None):
+		self.transcript = transcript
+		self.synthesizer = synthesizer
+		self.delay = delay
+		self.jitter = jitter
+		self.rate = rate
+		self.out = out
+		self.last_answer = 0. # when the last answer was written
+
+	def pause(self):
+		"""
+		Wait until the next answer is due.
+		"""
+		due = time.time() + self.delay
+		if self.jitter:
+			due += random.uniform(0., self.jitter)
+		if self.rate:
+			due = max(due, self.last_answer + 1. / self.rate)
+		wait = due - time.time()
+		if wait > 0:
+			time.sleep(wait)
+		self.last_answer = time.time()
+
+	def write(self, lines):
+		data = ''.join(lines)
+		while data:
+			data = data[os.write(self.out, data):]
+
+	def answer(self, line):
+		token, command = COMMAND_RE.match(line.strip()).groups()
+		if command.split()[:1] in ([ '-gdb-exit' ], [ 'quit' ]):
+			return None
+		lines = None
+		if self.transcript is not None:
+			lines = self.transcript.answer(command, token)
+		if lines is None and self.synthesizer is not None:
+			lines = self.synthesizer.answer(command, token)
+		if lines is None:
+			lines = error(token, 'fake gdb : no answer to %s' % command)
+		return lines
+
+	def run(self, stdin):
+		banner = self.transcript.banner if self.transcript is not None else []
+		if not banner:
+			banner = [ '=thread-group-added,id="i1"\n', PROMPT ]
+		self.write(banner)
+		for line in iter(stdin.readline, ''):
+			if not line.strip():
+				self.write([ PROMPT ])
+				continue
+			lines = self.answer(line)
+			if lines is None:
+				self.write([ '%s^exit\n' % COMMAND_RE.match(line.strip()).group(1) ])
+				return
+			self.pause()
+			self.write(lines)
+
+def main(argv):
+	optparser = OptionParser(usage = "%prog [--replay GDBIN GDBOUT] [options]")
+	optparser.add_option('--replay', nargs = 2, dest = 'replay', metavar = 'GDBIN GDBOUT',
+		help = "answer the commands recorded in these gdbin.log and gdbout.log files")
+	optparser.add_option('--delay', type = 'float', default = 0., help = "seconds to wait before each answer")
+	optparser.add_option('--jitter', type = 'float', default = 0., help = "up to this many more seconds, at random, before each answer")
+	optparser.add_option('--rate', type = 'float', default = None, help = "answers per second, at most")
+	optparser.add_option('--children', type = 'int', default = 100, help = "number of children of each var")
+	optparser.add_option('--changes', type = 'int', default = 10, help = "number of vars changed by each step")
+	optparser.add_option('--value-size', type = 'int', default = 8, help = "size of each value")
+	optparser.add_option('--target-lines', type = 'int', default = 0, help = "lines of target output on each step")
+	# passed by GdbMI
+	optparser.add_option('--tty')
+	optparser.add_option('--interpreter')
+	options, args = optparser.parse_args(argv)
+
+	transcript = None
+	if options.replay:
+		transcript = Transcript.load(*options.replay)
+	tty = None
+	if options.tty:
+		tty = os.open(options.tty, os.O_WRONLY | os.O_NOCTTY)
+	synthesizer = Synthesizer(options.children, options.changes, options.value_size, options.target_lines, tty)
+	stdin = os.fdopen(os.dup(sys.stdin.fileno()), 'r', 0)
+	FakeGdb(transcript, synthesizer, options.delay, jitter = options.jitter, rate = options.rate).run(stdin)
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -13,7 +13,8 @@ class GdbCommandBuilder(object):
 		"""
 		raise NotImplementedError()
 	
-	def _quote(self, arg):
+	@staticmethod
+	def _quote(arg):
 		return '"%s"' % (arg.replace('"', r'\"'))
 
 	def quit(self, token, **kwargs):	
@@ -0,0 +1,256 @@
+import time
+import heapq
+import threading
+import logging
+import traceback
+from Queue import Queue, Empty
+
+class GdbError(Exception):
+	"""
+	A command answered with ^error.
+	"""
+	def __init__(self, token, msg):
+		Exception.__init__(self, msg)
+		self.token = token
+		self.msg = msg
+
+class Timeout(Exception):
+	pass
+
+class GdbFuture(object):
+	"""
+	The eventual outcome of a gdb command : its result record,
+	the value returned by its response handler if it has one,
+	or the error it raised (a GdbError if gdb answered ^error).
+
+	result() blocks until the outcome is known.
+	Done callbacks are called with the future, in the thread that completes it
+	(the gdb output thread or a response handler thread) : they must not wait for gdb.
+	"""
+
+	def __init__(self, token = None):
+		self.token = token
+		self._cond = threading.Condition()
+		self._done = False
+		self._value = None
+		self._error = None
+		self._callbacks = []
+
+	def done(self):
+		return self._done
+
+	def set_result(self, value):
+		self._complete(value, None)
+
+	def set_exception(self, error):
+		self._complete(None, error)
+
+	def _complete(self, value, error):
+		with self._cond:
+			if self._done:
+				return
+			self._value = value
+			self._error = error
+			self._done = True
+			self._cond.notifyAll()
+			callbacks, self._callbacks = self._callbacks, []
+		for callback in callbacks:
+			self._call(callback)
+
+	def _call(self, callback):
+		try:
+			callback(self)
+		except Exception:
+			logging.getLogger("gdberr").error(traceback.format_exc())
+
+	def add_done_callback(self, callback):
+		with self._cond:
+			if not self._done:
+				self._callbacks.append(callback)
+				return
+		self._call(callback)
+
+	def wait(self, timeout = None):
+		"""
+		Return True once the future is done, False if the timeout expired first.
+		"""
+		with self._cond:
+			if self._done or timeout is None:
+				while not self._done:
+					self._cond.wait()
+				return True
+			# a timed Condition.wait polls with growing sleeps, which delays the wake up by up to 50 ms :
+			# wait without a timeout, and have the watchdog wake us up at the deadline
+			deadline = time.time() + timeout
+			alarm = watchdog.add(deadline, self._cond)
+			try:
+				while not self._done and time.time() < deadline:
+					self._cond.wait()
+			finally:
+				watchdog.cancel(alarm)
+			return self._done
+
+	def exception(self, timeout = None):
+		if not self.wait(timeout):
+			raise Timeout("Timeout : request %s" % self.token)
+		return self._error
+
+	def result(self, timeout = None):
+		error = self.exception(timeout)
+		if error is not None:
+			raise error
+		return self._value
+
+class Watchdog(object):
+	"""
+	Notifies conditions once their deadline has passed, from a single thread.
+	The thread runs while there are deadlines to watch.
+	"""
+
+	RESOLUTION = .05
+
+	def __init__(self):
+		self.cond = threading.Condition()
+		self.alarms = [] # heap of [deadline, condition], the condition is None once cancelled
+		self.pending = 0 # alarms not cancelled
+		self.thread = None
+
+	def add(self, deadline, cond):
+		"""
+		Return an alarm, to be cancelled once the deadline no longer matters.
+		"""
+		alarm = [ deadline, cond ]
+		with self.cond:
+			heapq.heappush(self.alarms, alarm)
+			self.pending += 1
+			if self.thread is None:
+				self.thread = threading.Thread(target = self.run, name = "Watchdog")
+				self.thread.setDaemon(True)
+				self.thread.start()
+		return alarm
+
+	def cancel(self, alarm):
+		with self.cond:
+			if alarm[1] is not None:
+				alarm[1] = None
+				self.pending -= 1
+
+	def run(self):
+		while True:
+			with self.cond:
+				if self.pending == 0:
+					# the next add() starts another thread
+					self.alarms = []
+					self.thread = None
+					return
+				expired = []
+				now = time.time()
+				while self.alarms and self.alarms[0][0] <= now:
+					alarm = heapq.heappop(self.alarms)
+					if alarm[1] is not None:
+						expired.append(alarm[1])
+						alarm[1] = None
+						self.pending -= 1
+			for cond in expired:
+				with cond:
+					cond.notifyAll()
+			time.sleep(self.RESOLUTION)
+
+watchdog = Watchdog()
+
+def wait_all(futures, timeout = None):
+	"""
+	Return the results of the futures, in order.
+	"""
+	return [ future.result(timeout) for future in futures ]
+
+class PendingRequests(object):
+	"""
+	The commands sent to gdb and not answered yet : their future and response handler, by token.
+	Tokens are allocated under a lock, so that concurrent senders never share one.
+	"""
+
+	def __init__(self, first_token = 1000001):
+		self.lock = threading.Lock()
+		self.next_token = first_token
+		self.requests = {} # token -> (future, on_response)
+
+	def new_token(self):
+		with self.lock:
+			token = self.next_token
+			self.next_token += 1
+		return token
+
+	def add(self, token, on_response = None):
+		"""
+		Register a request and return its future.
+		"""
+		future = GdbFuture(str(token))
+		with self.lock:
+			self.requests[str(token)] = (future, on_response)
+		return future
+
+	def pop(self, token):
+		"""
+		Return (future, on_response) of the request and forget it, or (None, None).
+		"""
+		with self.lock:
+			return self.requests.pop(token, (None, None))
+
+	def fail_all(self, msg):
+		"""
+		Fail the futures of all the requests with a GdbError, and forget them.
+		"""
+		with self.lock:
+			requests, self.requests = self.requests, {}
+		for token, (future, on_response) in requests.iteritems():
+			future.set_exception(GdbError(token, msg))
+
+	def __contains__(self, token):
+		return token in self.requests
+
+	def __len__(self):
+		return len(self.requests)
+
+class EventIterator(object):
+	"""
+	Iterates over the broadcasts of an EventSlot, as tuples of arguments.
+	Broadcasts are queued from the moment the iterator is created, until it is closed.
+
+		for frame, in session.events(session.onFrameChange):
+			...
+	"""
+
+	def __init__(self, slot, timeout = None):
+		self.slot = slot
+		self.timeout = timeout
+		self.queue = Queue()
+		slot.subscribe(self._on_event)
+
+	def _on_event(self, *args):
+		self.queue.put(args)
+
+	def __iter__(self):
+		return self
+
+	def next(self, timeout = None):
+		"""
+		Return the arguments of the next broadcast.
+		Raise StopIteration if none comes within the timeout.
+		"""
+		if timeout is None:
+			timeout = self.timeout
+		try:
+			if timeout is None:
+				# a blocking get() cannot be interrupted : wake up now and then
+				while True:
+					try:
+						return self.queue.get(True, 1.)
+					except Empty:
+						pass
+			return self.queue.get(True, timeout)
+		except Empty:
+			raise StopIteration
+
+	def close(self):
+		self.slot.unsubscribe(self._on_event)
@@ -0,0 +1,155 @@
+"""
+Keeps gdb processes started ahead of time, so that a new session does not wait for gdb.
+
+	pool = GdbMIPool(2, executable = 'myprog')
+	session = GdbSession(pool.acquire())
+	session.file('myprog') # already loaded : returns at once
+	...
+	pool.release(session)
+
+Loading the symbols of a big executable is most of gdb's startup time :
+the processes of a pool given an executable load it while they are idle.
+"""
+import os
+import time
+import select
+import logging
+import threading
+import traceback
+from collections import deque
+
+from pygdb import GdbMI
+from gdb_future import GdbError, Timeout
+from gdb_commands import GdbCommandBuilder
+
+PROMPT = '(gdb)'
+
+def read_until_prompt(gdb, deadline):
+	"""
+	Read gdb's output up to its next prompt, and return the lines before it.
+	The output is read one byte at a time : what follows the prompt is left unread,
+	for the session's reader.
+	"""
+	fd = gdb.gdbout.fileno()
+	lines = []
+	line = []
+	while True:
+		remaining = deadline - time.time()
+		if remaining <= 0:
+			raise Timeout("Timeout : gdb did not answer")
+		readable, _, _ = select.select([ fd ], [], [], remaining)
+		if not readable:
+			continue
+		char = os.read(fd, 1)
+		if not char:
+			raise GdbError(None, "gdb exited : %s" % ''.join(lines + line))
+		line.append(char)
+		if char == '\n':
+			line = ''.join(line)
+			if line.strip() == PROMPT:
+				return lines
+			lines.append(line)
+			line = []
+
+def warm_up(gdb, executable = None, timeout = 120.):
+	"""
+	Wait until gdb is ready, and load the symbols of executable if given.
+	"""
+	deadline = time.time() + timeout
+	read_until_prompt(gdb, deadline)
+	if executable is None:
+		return
+	executable = os.path.abspath(executable)
+	gdb.gdbin.write("-file-exec-and-symbols %s\n" % GdbCommandBuilder._quote(executable))
+	for line in read_until_prompt(gdb, deadline):
+		if line.startswith('^error'):
+			raise GdbError(None, line.strip())
+	gdb.executable = executable
+
+class GdbMIPool(object):
+	"""
+	Keeps `size` idle gdb processes ready to be handed out to sessions.
+	Missing processes are started and warmed up in parallel, each by a thread of its own.
+
+	Sessions get a process with acquire(), and give it back with release() once done :
+	the session is then closed and the process terminated, since the state of a gdb session
+	cannot be reset reliably. Its replacement was started when it was acquired.
+	"""
+
+	WARM_TIMEOUT = 120.
+
+	def __init__(self, size = 1, executable = None, gdb = None):
+		self.size = size
+		self.executable = executable
+		self.gdb = gdb
+		self.cond = threading.Condition()
+		self.idle = deque()
+		self.warming = 0 # processes being started
+		self.error = None # why the last process could not be started
+		self.closed = False
+		self.errlog = logging.getLogger("gdberr")
+		with self.cond:
+			self._refill()
+
+	def _refill(self):
+		# with self.cond held
+		while not self.closed and self.error is None and len(self.idle) + self.warming < self.size:
+			self.warming += 1
+			thread = threading.Thread(target = self._warm_one, name = "GdbMIPool")
+			thread.setDaemon(True)
+			thread.start()
+
+	def _warm_one(self):
+		gdb = None
+		try:
+			gdb = GdbMI(self.gdb)
+			warm_up(gdb, self.executable, self.WARM_TIMEOUT)
+		except Exception, err:
+			self.errlog.error(traceback.format_exc())
+			if gdb is not None:
+				gdb.close()
+			with self.cond:
+				# no more attempts : acquire() raises the error
+				self.warming -= 1
+				self.error = err
+				self.cond.notifyAll()
+			return
+		with self.cond:
+			self.warming -= 1
+			closed = self.closed
+			if not closed:
+				self.idle.append(gdb)
+				self.cond.notifyAll()
+		if closed:
+			# terminating gdb takes a while : not with the lock held
+			gdb.close()
+
+	def acquire(self):
+		"""
+		Return an idle gdb process, waiting for one to be ready if needed.
+		"""
+		with self.cond:
+			while not self.idle:
+				if self.error is not None:
+					raise self.error
+				if self.closed:
+					raise ValueError("GdbMIPool is closed")
+				self.cond.wait()
+			gdb = self.idle.popleft()
+			self._refill()
+			return gdb
+
+	def release(self, session):
+		"""
+		Close the GdbSession running a process handed out by acquire(), which terminates it.
+		A process no session was started with may be given instead.
+		"""
+		session.close()
+
+	def close(self):
+		with self.cond:
+			self.closed = True
+			idle, self.idle = self.idle, deque()
+			self.cond.notifyAll()
+		for gdb in idle:
+			gdb.close()
@@ -1,8 +1,43 @@
+import re
 from recparse import *
+from recparse_codegen import CompiledParser
+
+# ========== C STRINGS ==========
+
+C_ESCAPES = {
+	'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v',
+	'\\': '\\', '"': '"', "'": "'", '?': '?', '\n': '',
+}
+C_ESCAPE_RE = re.compile(r'\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))', re.DOTALL)
+
+def _unescape_match(m):
+	octal, hexa, c = m.groups()
+	if octal is not None:
+		return chr(int(octal, 8) & 0xff)
+	if hexa is not None:
+		return chr(int(hexa, 16))
+	return C_ESCAPES.get(c, '\\' + c)
+
+def unescape(s):
+	"""
+	Decode the escape sequences of the body of a C string literal.
+	Unknown escapes are left as they are.
+	"""
+	if '\\' not in s:
+		return s
+	if '\\?' not in s:
+		# decodes the same escapes in C, in one pass
+		try:
+			return s.decode('string_escape')
+		except ValueError:
+			# '\x' without hex digits
+			pass
+	return C_ESCAPE_RE.sub(_unescape_match, s)
 
 # ========== LEXER ==========
 
-ESC_SEQ    = (Literal('\\') + AnyToken()).set_result(lambda tok, res: eval("'%s%s'" % (res[0], res[1])))
+ESC_CHARS  = Literal('\\') + AnyToken()
+ESC_SEQ    = Group(ESC_CHARS).set_text_result(unescape)
 
 lex = Lexer(
 	WHITESPACE = (Literal(' ') | Literal("\t")).ignore(),
@@ -19,7 +54,7 @@ lex = Lexer(
 	RSQUARE    = Literal(']'),
 	COMMA      = Literal(','),
 	ESC_SEQ    = ESC_SEQ,
-	CSTR       = (Literal('"') + (ExcludeChars('"\\') | ESC_SEQ) * (0,) + Literal('"')).set_result(lambda tok,res: ''.join(res[1])),
+	CSTR       = (Literal('"') + (ExcludeChars('"\\') | ESC_CHARS) * (0,) + Literal('"')).set_text_result(lambda text: unescape(text[1:-1])),
 	IDENT      = Word('-_abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'),
 	TOKEN      = Word('0123456789'),
 	STOP       = Literal('(gdb)'),
@@ -27,16 +62,63 @@ lex = Lexer(
 )
 
 # ========== RESULT STRUCTURES ==========
+
+class StructLayout(object):
+	"""
+	The field names of a struct, and their position in its values.
+	Structs of the same shape share one layout.
+	"""
+	__slots__ = ('keys', 'index')
+
+	def __init__(self, keys):
+		self.keys = tuple(intern(k) if type(k) is str else k for k in keys)
+		# with duplicate names, the last value wins (as in a dict)
+		self.index = dict((k, i) for i, k in enumerate(self.keys))
+
+MAX_LAYOUTS = 4096
+LAYOUTS = {}
+
+def struct_layout(keys):
+	layout = LAYOUTS.get(keys)
+	if layout is None:
+		layout = StructLayout(keys)
+		if len(LAYOUTS) < MAX_LAYOUTS:
+			LAYOUTS[layout.keys] = layout
+	return layout
+
 class struct(object):
+	"""
+	A GDB/MI tuple. Fields are read as attributes, by indexing or with get().
+	"""
+	__slots__ = ('_layout', '_values')
+
 	def __init__(self, dikt):
-		self._data = dict(dikt)
-		self.__dict__.update(dict(dikt))
+		items = dikt.items() if isinstance(dikt, dict) else list(dikt)
+		self._layout = struct_layout(tuple([ k for k, v in items ]))
+		self._values = tuple([ v for k, v in items ])
+
+	def __getattr__(self, name):
+		if name in struct.__slots__:
+			raise AttributeError(name)
+		try:
+			return self._values[self._layout.index[name]]
+		except KeyError:
+			raise AttributeError(name)
+
+	@property
+	def _data(self):
+		values = self._values
+		return dict((k, values[i]) for k, i in self._layout.index.iteritems())
+
 	def __repr__(self):
 		return "struct(%s)" % repr(self._data)
 	def __getitem__(self, i):
-		return self._data[i]
+		return self._values[self._layout.index[i]]
 	def get(self, name, default = None):
-		return self._data.get(name, default)
+		i = self._layout.index.get(name)
+		return default if i is None else self._values[i]
+	def __reduce__(self):
+		return (struct, (self._data,))
 
 # ========== PARSER ==========
 
@@ -46,7 +128,8 @@ result      = lex.IDENT + lex.EQ + value                                  >= (la
 result_list = DelimitedList(result, lex.COMMA)
 results     = DelimitedList(result, lex.COMMA)                            >= (lambda tok,val: struct(dict(val)))
 values      = DelimitedList(value, lex.COMMA)
-tuple_      = lex.LCURLY + results + lex.RCURLY                           >= (lambda tok,val: val[1])
+# '{}' is a valid, empty tuple in the GDB/MI output syntax
+tuple_      = lex.LCURLY + Optional(results) + lex.RCURLY                 >= (lambda tok,val: val[1] if val[1] is not None else struct(()))
 list_       = lex.LSQUARE + Optional(values | result_list) + lex.RSQUARE  >= (lambda tok,val: val[1])
 value      << (lex.CSTR | tuple_ | list_)
 async_class = lex.IDENT
@@ -54,20 +137,47 @@ optional_results = Optional((lex.COMMA + results)[1])
 async_output = async_class + optional_results
 result_class = lex.IDENT
 
-gdbout      = lambda V: (lex.TILDE + lex.CSTR)[1]     >= (lambda tok,val: V.onGdbOutput(val))
-targetout   = lambda V: (lex.AT + lex.CSTR)[1]        >= (lambda tok,val: V.onTargetOutput(val))
-gdberr      = lambda V: (lex.AMPERSAND + lex.CSTR)[1] >= (lambda tok,val: V.onGdbErr(val))
+# Records reduce to (visitor method name, args), or None for the '(gdb)' prompt,
+# as in gdbmi_record_parser.parse_record : the grammar does not depend on the visitor.
+
+gdbout      = (lex.TILDE + lex.CSTR)[1]     >= (lambda tok,val: ('onGdbOutput', (val,)))
+targetout   = (lex.AT + lex.CSTR)[1]        >= (lambda tok,val: ('onTargetOutput', (val,)))
+gdberr      = (lex.AMPERSAND + lex.CSTR)[1] >= (lambda tok,val: ('onGdbErr', (val,)))
 
-notify_msg  = lambda V: (Optional(lex.TOKEN) + lex.EQ + async_output)    >= (lambda tok,val: V.onNotifyAsyncOutput(val[0], *val[2]))
-exec_msg    = lambda V: (Optional(lex.TOKEN) + lex.STAR + async_output)  >= (lambda tok,val: V.onExecAsyncOutput(val[0], *val[2]))
-status_msg  = lambda V: (Optional(lex.TOKEN) + lex.PLUS + async_output)  >= (lambda tok,val: V.onStatusAsyncOutput(val[0], *val[2]))
+notify_msg  = (Optional(lex.TOKEN) + lex.EQ + async_output)    >= (lambda tok,val: ('onNotifyAsyncOutput', (val[0],) + tuple(val[2])))
+exec_msg    = (Optional(lex.TOKEN) + lex.STAR + async_output)  >= (lambda tok,val: ('onExecAsyncOutput', (val[0],) + tuple(val[2])))
+status_msg  = (Optional(lex.TOKEN) + lex.PLUS + async_output)  >= (lambda tok,val: ('onStatusAsyncOutput', (val[0],) + tuple(val[2])))
 
-result_rec  = lambda V: (Optional(lex.TOKEN) + lex.HAT + result_class + optional_results) >= (lambda tok,val: V.onResultRecord(val[0], val[2], val[3]))
+result_rec  = (Optional(lex.TOKEN) + lex.HAT + result_class + optional_results) >= (lambda tok,val: ('onResultRecord', (val[0], val[2], val[3])))
 
-stream_rec  = lambda V: (gdbout(V) | targetout(V) | gdberr(V))
-async_rec   = lambda V: (exec_msg(V) | notify_msg(V) | status_msg(V))
+stream_rec  = gdbout | targetout | gdberr
+async_rec   = exec_msg | notify_msg | status_msg
+stop        = lex.STOP >= (lambda tok,val: None)
 
-gdbmi_output = lambda V: (async_rec(V) | stream_rec(V) | result_rec(V) | lex.STOP) + lex.EOL    >= (lambda tok, val: (val[0]))
+gdbmi_output = (async_rec | stream_rec | result_rec | stop) + lex.EOL    >= (lambda tok, val: (val[0]))
+
+# shared by all parsers
+compiled_gdbmi_output = CompiledParser(gdbmi_output, 'gdbmi_output')
+
+class GdbMIParser(object):
+	"""
+	Parses lines of gdb output, calling the visitor's handler for each record.
+	Unless compiled is unset, the grammar runs as generated code (see recparse_codegen).
+	"""
+	def __init__(self, visitor, compiled = True):
+		self.V = visitor
+		self.parser = compiled_gdbmi_output if compiled else gdbmi_output
+
+	def parse(self, line):
+		"""
+		Return False if the line could not be parsed.
+		"""
+		tokens = lex.lex(line)
+		success, result = self.parser.try_parse(tokens)
+		if success and result.value is not None:
+			method, args = result.value
+			getattr(self.V, method)(*args)
+		return success
 
 if __name__ == '__main__':
 
@@ -90,9 +200,11 @@ if __name__ == '__main__':
 	print toks
 	tokstream = TokenStream(iter(toks))
 
-	success, result = gdbmi_output(v).try_parse(tokstream)
+	success, result = gdbmi_output.try_parse(tokstream)
 	print success
 	if success:
 		print result.tokens
 		print result.value
 
+	print GdbMIParser(v).parse(inputstr)
+
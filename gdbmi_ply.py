@@ -1,112 +1,110 @@
+"""
+PLY based GDB/MI output parser.
+
+Its LALR tables are built once and cached on disk, in a file keyed by a hash of the grammar.
+It builds the same values as gdbmi_output_parser and gdbmi_record_parser.
+"""
+import os
+import copy
+import hashlib
+import threading
+
 import ply.lex as lex
 import ply.yacc as yacc
 
+from gdbmi_output_parser import struct, unescape
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mygdb')
+
 # ########## LEXER ##########
 
-tokens = [
-	'EQ', 'STAR', 'PLUS', 'TILDE', 'AT', 'HAT', 'AMPERS',
-	'LCURLY', 'RCURLY', 'LSQUARE', 'RSQUARE', 'COMMA', 'ESC_SEQ',
-	'C_STR', 'IDENT', 'TOKEN', 'STOP', 'EOL'
-]
-
-
-t_EQ      = r'='
-t_STAR    = r'\*'
-t_PLUS    = r'\+'
-t_TILDE   = r'\~'
-t_AT      = r'@'
-t_HAT     = r'\^'
-t_AMPERS  = r'&'
-t_LCURLY  = r'\{'
-t_RCURLY  = r'\}'
-t_LSQUARE = r'\['
-t_RSQUARE = r'\]'
-t_COMMA   = r','
-t_ESC_SEQ = r'\.'
-#def t_C_STR(t):
-#	#r'"([^"\\]|\\.)*"'
-#	t.value = t.value[1:-1]
-t_C_STR   = r'"[^"]*"'
-t_IDENT   = r'[a-zA-Z_-]+'
-t_TOKEN   = r'[0-9]+'
-t_STOP    = r'(gdb)'
-t_EOL     = r'[\n\r]+'
-
-t_ignore = " \t"
-
-lex.lex()
+class GdbMILexer(object):
+
+	tokens = [
+		'EQ', 'STAR', 'PLUS', 'TILDE', 'AT', 'HAT', 'AMPERS',
+		'LCURLY', 'RCURLY', 'LSQUARE', 'RSQUARE', 'COMMA',
+		'C_STR', 'IDENT', 'TOKEN', 'STOP', 'EOL'
+	]
+
+	t_EQ      = r'='
+	t_STAR    = r'\*'
+	t_PLUS    = r'\+'
+	t_TILDE   = r'\~'
+	t_AT      = r'@'
+	t_HAT     = r'\^'
+	t_AMPERS  = r'&'
+	t_LCURLY  = r'\{'
+	t_RCURLY  = r'\}'
+	t_LSQUARE = r'\['
+	t_RSQUARE = r'\]'
+	t_COMMA   = r','
+	t_IDENT   = r'[a-zA-Z_-]+'
+	t_TOKEN   = r'[0-9]+'
+
+	t_ignore = " \t"
+
+	def t_C_STR(self, t):
+		r'"(?:[^"\\]|\\[\s\S])*"'
+		t.value = unescape(t.value[1:-1])
+		return t
+
+	def t_STOP(self, t):
+		r'\(gdb\)'
+		return t
+
+	def t_EOL(self, t):
+		r'[\n\r]+'
+		# a record ends at the end of its line : ignore what may follow
+		t.lexer.lexpos = t.lexer.lexlen
+		return t
+
+	def t_error(self, t):
+		raise SyntaxError("GDB/MI illegal character %s" % repr(t.value[0]))
 
 # ########## PARSER ##########
 
-class GdbMIParser:
-	
-	V = None
-	tokens = tokens
+class GdbMIGrammar(object):
+	"""
+	Each record reduces to (visitor method name, args), or None for the '(gdb)' prompt,
+	as in gdbmi_record_parser.parse_record.
+	"""
+
+	tokens = GdbMILexer.tokens
 
-	def __init__(self, visitor):
-		self.V = visitor
-	
-	def build(self):
-		self.parser = yacc.yacc(module = self, start = 'gdbmi_output')
-	
 	def p_optional_TOKEN_0(self, p):
 		'optional_TOKEN : '
 		p[0] = None
 	def p_optional_TOKEN_1(self, p):
 		'optional_TOKEN : TOKEN'
 		p[0] = p[1]
-	def p_optional_results_0(self, p):
-		'optional_results : '
-		p[0] = None
-	def p_optional_results_1(self, p):
-		'optional_results : results'
-		p[0] = p[1]
 
 	# Stream Records
 	def p_gdbout(self, p):
-		'gdbout : TILDE C_STR'
-		p[0] = p[2]
-		self.V.onGdbOutput(p[2])
+		'stream_rec : TILDE C_STR'
+		p[0] = ('onGdbOutput', (p[2],))
 	def p_targetout(self, p):
-		'targetout : AT C_STR'
-		p[0] = p[2]
-		self.V.onTargetOutput(p[2])
+		'stream_rec : AT C_STR'
+		p[0] = ('onTargetOutput', (p[2],))
 	def p_gdberr(self, p):
-		'gdberr : AMPERS C_STR'
-		p[0] = p[2]
-		self.V.onGdbErr(p[2])
-	def p_stream_rec(self, p):
-		"""stream_rec : gdbout
-			      | targetout
-			      | gdberr
-		"""
-		p[0] = p[1]
+		'stream_rec : AMPERS C_STR'
+		p[0] = ('onGdbErr', (p[2],))
 
 	# Async records
-	def p_async_output1(self, p):
-		'async_output : IDENT'
-		p[0] = (p[1], [])
-	def p_async_output2(self, p):
-		'async_output : IDENT COMMA results'
-		p[0] = (p[1], p[3])
+	def p_output_class_1(self, p):
+		'output_class : IDENT'
+		p[0] = (p[1], None)
+	def p_output_class_2(self, p):
+		'output_class : IDENT COMMA results'
+		p[0] = (p[1], struct(p[3]))
 	def p_notify_msg(self, p):
-		'notify_msg : optional_TOKEN EQ async_output'
-		p[0] = p[3]
-		self.V.onNotifyAsyncOutput(p[1], *p[3])
+		'async_rec : optional_TOKEN EQ output_class'
+		p[0] = ('onNotifyAsyncOutput', (p[1],) + p[3])
 	def p_exec_msg(self, p):
-		'exec_msg : optional_TOKEN STAR async_output'
-		p[0] = p[3]
-		self.V.onExecAsyncOutput(p[1], *p[3])
+		'async_rec : optional_TOKEN STAR output_class'
+		p[0] = ('onExecAsyncOutput', (p[1],) + p[3])
 	def p_status_msg(self, p):
-		'status_msg : optional_TOKEN PLUS async_output'
-		p[0] = p[3]
-		self.V.onStatusAsyncOutput(p[1], *p[3])
-	def p_async_rec(self, p):
-		"""async_rec : notify_msg
-			     | exec_msg
-			     | status_msg
-		"""
-		p[0] = p[1]
+		'async_rec : optional_TOKEN PLUS output_class'
+		p[0] = ('onStatusAsyncOutput', (p[1],) + p[3])
 
 	# Result Records
 	def p_result(self, p):
@@ -116,65 +114,164 @@ class GdbMIParser:
 		'results : result'
 		p[0] = [p[1]]
 	def p_results_n(self, p):
-		'results : result COMMA results'
-		p[0] = [p[1]] + p[3] # TODO this has n^2 running time ...
+		'results : results COMMA result'
+		p[1].append(p[3])
+		p[0] = p[1]
 	def p_values_1(self, p):
 		'values : value'
 		p[0] = [p[1]]
 	def p_values_n(self, p):
-		'values : value COMMA values'
-		p[0] = [p[1]] + p[3] # TODO n^2 complextity
+		'values : values COMMA value'
+		p[1].append(p[3])
+		p[0] = p[1]
+	# '{}' is an empty tuple in the GDB/MI output syntax, and in the reference grammar
+	def p_tuple_void(self, p):
+		'tuple : LCURLY RCURLY'
+		p[0] = struct(())
 	def p_tuple(self, p):
 		'tuple : LCURLY results RCURLY'
-		p[0] = p[2]
+		p[0] = struct(p[2])
 	def p_list_void(self, p):
 		'list : LSQUARE RSQUARE'
-		p[0] = []
+		p[0] = None
 	def p_list_values(self, p):
 		'list : LSQUARE values RSQUARE'
 		p[0] = p[2]
 	def p_list_results(self, p):
-		'list : LSQUARE results RSQUARE '
+		'list : LSQUARE results RSQUARE'
 		p[0] = p[2]
 	def p_value(self, p):
-		"""value : C_STR 
-			 | tuple 
+		"""value : C_STR
+			 | tuple
 			 | list
 		"""
 		p[0] = p[1]
 	def p_result_rec(self, p):
-		'result_rec : optional_TOKEN HAT IDENT optional_results'
-		self.V.onResultRecord(p[1], p[3], p[4])
+		'result_rec : optional_TOKEN HAT output_class'
+		p[0] = ('onResultRecord', (p[1],) + p[3])
 
 	# Start Rule:
 	def p_gdbmi_output(self, p):
 		"""gdbmi_output : async_rec EOL
 				| stream_rec EOL
 				| result_rec EOL
-				| STOP EOL
 		"""
 		p[0] = p[1]
+	def p_gdbmi_output_stop(self, p):
+		'gdbmi_output : STOP EOL'
+		p[0] = None
+
+	def p_error(self, p):
+		raise SyntaxError("GDB/MI syntax error at %s" % (repr(p.value) if p is not None else 'end of line'))
+
+def grammar_hash():
+	"""
+	A hash of the tokens and rules of the grammar, which names the cached parser tables.
+	"""
+	h = hashlib.sha1()
+	h.update(yacc.__tabversion__)
+	h.update(' '.join(GdbMIGrammar.tokens))
+	for name in sorted(dir(GdbMIGrammar)):
+		if name.startswith('p_'):
+			h.update(name)
+			h.update(getattr(GdbMIGrammar, name).__doc__ or '')
+	return h.hexdigest()[:16]
+
+def build_parser(cache_dir = CACHE_DIR):
+	"""
+	Build the parser, reading its LALR tables from the cache directory when they were built before.
+	"""
+	grammar = GdbMIGrammar()
+	def build(picklefile = None):
+		return yacc.yacc(module = grammar, start = 'gdbmi_output',
+			debug = False, write_tables = False, picklefile = picklefile,
+			errorlog = yacc.NullLogger())
+	picklefile = os.path.join(cache_dir, 'gdbmi_ply_%s.pickle' % grammar_hash())
+	if os.path.exists(picklefile):
+		try:
+			return build(picklefile)
+		except Exception:
+			# unreadable cache file : rebuild it
+			pass
+	try:
+		if not os.path.isdir(cache_dir):
+			os.makedirs(cache_dir)
+		# write to a private file first, so that concurrent readers never see half a table
+		tmpfile = "%s.%d.tmp" % (picklefile, os.getpid())
+		parser = build(tmpfile)
+		os.rename(tmpfile, picklefile)
+		return parser
+	except OSError:
+		# no cache : build the tables every time
+		return build()
+
+_lexer = None
+_parser = None
+_build_lock = threading.Lock()
 
-#yacc.yacc(start = 'gdbmi_output', module = GdbMIParser)
+def _shared():
+	global _lexer, _parser
+	with _build_lock:
+		if _parser is None:
+			_lexer = lex.lex(module = GdbMILexer())
+			_parser = build_parser()
+	return _lexer, _parser
+
+class GdbMIParser(object):
+	"""
+	Parses lines of gdb output, calling the visitor's handler for each record.
+	"""
+	def __init__(self, visitor):
+		self.V = visitor
+		lexer, parser = _shared()
+		# the tables are shared, the parsing state is not
+		self.lexer = lexer.clone()
+		self.parser = copy.copy(parser)
+
+	def parse(self, line):
+		"""
+		Return False if the line could not be parsed.
+		"""
+		try:
+			record = self.parser.parse(line, lexer = self.lexer)
+		except SyntaxError:
+			return False
+		if record is not None:
+			method, args = record
+			getattr(self.V, method)(*args)
+		return True
 
 if __name__ == '__main__':
-	
+
+	import gdbmi_output_parser
+	import gdbmi_record_parser
+	from timeit import Timer
+
 	class Visitor(object):
 		def __getattr__(self, name):
 			def handler(*args):
-				#print "GOT: %s %s" % (name, repr(args))
 				pass
 			return handler
 
-	inputstr = '1000003*stopped,reason="breakpoint-hit",bkptno="1",thread-id="0",frame={addr="0x08048428",func="main",args=[{name="argc",value="1"},{name="argv",value="0xbfbb3cb4"}],file="hello.c",fullname="/some/path/to/hello.c",line="16"}\n'
-	# p = yacc.parser
-	# p.V = Visitor()
-	p = GdbMIParser(Visitor())
-	p.build()
-	p.parser.parse(inputstr)
-	
-	from timeit import Timer
-	
-	timer = Timer(lambda: p.parser.parse(inputstr))
-	print timer.timeit(number = 1000)
+	lines = [
+		'1000003*stopped,reason="breakpoint-hit",bkptno="1",thread-id="0",frame={addr="0x08048428",func="main",args=[{name="argc",value="1"},{name="argv",value="0xbfbb3cb4"}],file="hello.c",fullname="/some/path/to/hello.c",line="16"}\n',
+		'(gdb) \n',
+		'^running\n',
+		'*running,thread-id="all"\n',
+		'~"Reading symbols from /tmp/hello...done.\\n"\n',
+		'1000010^done,numchild="2",children=[child={name="var1.a",exp="a",numchild="0",type="int"},child={name="var1.b",exp="b",numchild="1",type="char *"}]\n',
+	]
+	nbytes = sum(len(line) for line in lines)
+	number = 200
 
+	backends = [
+		('recparse', gdbmi_output_parser.GdbMIParser(Visitor())),
+		('ply', GdbMIParser(Visitor())),
+		('record', gdbmi_record_parser.GdbMIParser(Visitor(), lazy = False)),
+	]
+	for name, parser in backends:
+		def run():
+			for line in lines:
+				parser.parse(line)
+		secs = Timer(run).timeit(number = number)
+		print "%-10s %10.0f lines/sec %8.2f MB/sec" % (name, number * len(lines) / secs, number * nbytes / secs / 1e6)
@@ -0,0 +1,389 @@
+"""
+Hand-written GDB/MI output parser.
+
+Decodes a complete output record in a single left-to-right scan over the line,
+and builds the same values (struct objects, lists, strings) as the recparse grammar
+in gdbmi_output_parser, which remains the reference implementation.
+Both follow the GDB/MI output syntax, in which '{}' is an empty tuple and '[]' an empty list.
+"""
+import re
+
+from gdbmi_output_parser import struct, unescape
+
+# ========== SCANNING ==========
+
+IDENT_RE = re.compile(r'[-_a-zA-Z]+')
+TOKEN_RE = re.compile(r'[0-9]+')
+CSTR_RE  = re.compile(r'"((?:[^"\\]|\\.)*)"', re.DOTALL)
+EOL_RE   = re.compile(r'[ \t]*[\n\r]+')
+SKIP_RE  = re.compile(r'[^"{}\[\]]+')
+# a tuple or list with no nested tuple or list
+FLAT_RE  = re.compile(r'(?:\{|\[)(?:[^"{}\[\]]|"(?:[^"\\]|\\.)*")*(?:\}|\])', re.DOTALL)
+WHITESPACE = ' \t'
+
+class NoMatch(Exception):
+	pass
+
+def _skip_ws(s, pos):
+	while s[pos] in WHITESPACE:
+		pos += 1
+	return pos
+
+def _expect(s, pos, c):
+	pos = _skip_ws(s, pos)
+	if s[pos] != c:
+		raise NoMatch
+	return pos + 1
+
+def _ident(s, pos):
+	m = IDENT_RE.match(s, _skip_ws(s, pos))
+	if m is None:
+		raise NoMatch
+	return m.group(), m.end()
+
+def _cstr(s, pos):
+	m = CSTR_RE.match(s, pos)
+	if m is None:
+		raise NoMatch
+	return unescape(m.group(1)), m.end()
+
+def _value(s, pos):
+	pos = _skip_ws(s, pos)
+	c = s[pos]
+	if c == '"':
+		return _cstr(s, pos)
+	elif c == '{':
+		return _tuple(s, pos + 1)
+	elif c == '[':
+		return _list(s, pos + 1)
+	raise NoMatch
+
+def _result(s, pos):
+	name, pos = _ident(s, pos)
+	pos = _expect(s, pos, '=')
+	value, pos = _value(s, pos)
+	return (name, value), pos
+
+def _result_list(s, pos):
+	res = []
+	while True:
+		item, pos = _result(s, pos)
+		res.append(item)
+		pos = _skip_ws(s, pos)
+		if s[pos] != ',':
+			return res, pos
+		pos += 1
+
+def _values(s, pos):
+	res = []
+	while True:
+		item, pos = _value(s, pos)
+		res.append(item)
+		pos = _skip_ws(s, pos)
+		if s[pos] != ',':
+			return res, pos
+		pos += 1
+
+def _tuple(s, pos):
+	pos = _skip_ws(s, pos)
+	if s[pos] == '}':
+		return struct(()), pos + 1
+	items, pos = _result_list(s, pos)
+	return struct(items), _expect(s, pos, '}')
+
+def _list(s, pos):
+	pos = _skip_ws(s, pos)
+	c = s[pos]
+	if c == ']':
+		return None, pos + 1
+	elif c in '"{[':
+		items, pos = _values(s, pos)
+	else:
+		items, pos = _result_list(s, pos)
+	return items, _expect(s, pos, ']')
+
+def _optional_results(s, pos, lazy = False):
+	pos = _skip_ws(s, pos)
+	if s[pos] != ',':
+		return None, pos
+	if lazy:
+		return _lazy_results(s, pos + 1)
+	items, pos = _result_list(s, pos + 1)
+	return struct(items), pos
+
+# ========== LAZY DECODING ==========
+
+CLOSING = { '{': '}', '[': ']' }
+
+def _skip_value(s, pos):
+	"""
+	Return the end of the value starting at pos.
+	Only the strings and the nesting of brackets are checked.
+	"""
+	c = s[pos]
+	if c == '"':
+		m = CSTR_RE.match(s, pos)
+		if m is None:
+			raise NoMatch
+		return m.end()
+	if c not in CLOSING:
+		raise NoMatch
+	closers = []
+	while True:
+		c = s[pos]
+		if c in CLOSING:
+			m = FLAT_RE.match(s, pos)
+			if m is not None and m.group()[-1] == CLOSING[c]:
+				pos = m.end()
+				if not closers:
+					return pos
+				continue
+			closers.append(CLOSING[c])
+			pos += 1
+		elif c == '"':
+			m = CSTR_RE.match(s, pos)
+			if m is None:
+				raise NoMatch
+			pos = m.end()
+		elif c == '}' or c == ']':
+			if closers.pop() != c:
+				raise NoMatch
+			pos += 1
+			if not closers:
+				return pos
+		else:
+			pos = SKIP_RE.match(s, pos).end()
+
+def _lazy_results(s, pos):
+	offsets = {}
+	while True:
+		name, pos = _ident(s, pos)
+		pos = _skip_ws(s, _expect(s, pos, '='))
+		end = _skip_value(s, pos)
+		offsets[name] = pos
+		pos = _skip_ws(s, end)
+		if s[pos] != ',':
+			return LazyStruct(s, offsets), pos
+		pos += 1
+
+def _lazy_value(s, pos):
+	pos = _skip_ws(s, pos)
+	c = s[pos]
+	if c == '"':
+		return _cstr(s, pos)
+	elif c == '{':
+		pos = _skip_ws(s, pos + 1)
+		if s[pos] == '}':
+			return LazyStruct(s, {}), pos + 1
+		value, pos = _lazy_results(s, pos)
+		return value, _expect(s, pos, '}')
+	elif c == '[':
+		pos = _skip_ws(s, pos + 1)
+		c = s[pos]
+		if c == ']':
+			return None, pos + 1
+		res = []
+		while True:
+			if c in '"{[':
+				item, pos = _lazy_value(s, pos)
+			else:
+				name, pos = _ident(s, pos)
+				value, pos = _lazy_value(s, _expect(s, pos, '='))
+				item = (name, value)
+			res.append(item)
+			pos = _skip_ws(s, pos)
+			if s[pos] != ',':
+				return res, _expect(s, pos, ']')
+			pos = _skip_ws(s, pos + 1)
+	raise NoMatch
+
+class LazyStruct(struct):
+	"""
+	A struct that keeps the offsets of its values in the source line,
+	and decodes each value the first time it is accessed.
+	Nested tuples are LazyStructs themselves.
+
+	Decoding only checks the strings and brackets of the nested values up front : 
+	a syntax error inside a value is reported (as a SyntaxError) when the value is accessed.
+	"""
+	def __init__(self, line, offsets):
+		self.__dict__['_line'] = line
+		self.__dict__['_offsets'] = offsets
+
+	def __getattr__(self, name):
+		offsets = self.__dict__.get('_offsets')
+		if offsets is None or name not in offsets:
+			raise AttributeError(name)
+		try:
+			value, pos = _lazy_value(self._line, offsets[name])
+		except (NoMatch, IndexError):
+			raise SyntaxError("GDB/MI syntax error in value of %s : %s" % (name, self._line))
+		self.__dict__[name] = value
+		return value
+
+	def __getitem__(self, name):
+		if name not in self._offsets:
+			raise KeyError(name)
+		return getattr(self, name)
+
+	def get(self, name, default = None):
+		if name not in self._offsets:
+			return default
+		return getattr(self, name)
+
+	@property
+	def _data(self):
+		return dict((name, getattr(self, name)) for name in self._offsets)
+
+def _eol(s, pos):
+	m = EOL_RE.match(s, pos)
+	if m is None:
+		raise NoMatch
+	return m.end()
+
+STREAM_RECORDS = {
+	'~': 'onGdbOutput',
+	'@': 'onTargetOutput',
+	'&': 'onGdbErr',
+}
+
+OUTPUT_RECORDS = {
+	'*': 'onExecAsyncOutput',
+	'=': 'onNotifyAsyncOutput',
+	'+': 'onStatusAsyncOutput',
+	'^': 'onResultRecord',
+}
+
+STOP = '(gdb)'
+
+def parse_record(line, lazy = False):
+	"""
+	Parse one line of gdb output.
+	Return (visitor method name, args) , or None for the '(gdb)' prompt.
+	Raise NoMatch if the line is not a valid GDB/MI output record.
+	If lazy is set, results are returned as a LazyStruct.
+	"""
+	try:
+		pos = _skip_ws(line, 0)
+		c = line[pos]
+		if c in STREAM_RECORDS:
+			string, pos = _cstr(line, _skip_ws(line, pos + 1))
+			_eol(line, pos)
+			return STREAM_RECORDS[c], (string,)
+		elif c == '(':
+			if not line.startswith(STOP, pos):
+				raise NoMatch
+			_eol(line, pos + len(STOP))
+			return None
+		token = None
+		m = TOKEN_RE.match(line, pos)
+		if m is not None:
+			token = m.group()
+			pos = _skip_ws(line, m.end())
+		c = line[pos]
+		if c not in OUTPUT_RECORDS:
+			raise NoMatch
+		klass, pos = _ident(line, pos + 1)
+		results, pos = _optional_results(line, pos, lazy)
+		_eol(line, pos)
+		return OUTPUT_RECORDS[c], (token, klass, results)
+	except IndexError:
+		raise NoMatch
+
+# ========== CACHE ==========
+
+class RecordCache(object):
+	"""
+	A bounded cache of line -> parsed record, for the lines gdb repeats verbatim
+	('(gdb) ', '^running', '*running,thread-id="all"', ...).
+	Lines longer than max_line are never cached : they are seldom repeated.
+
+	Eviction is LRU by halves : records go to the recent half, a hit in the older half
+	moves the record back to the recent one, and when the recent half is full 
+	the older one is dropped. A hit in the recent half is a single dict lookup.
+
+	Cached records are shared by all the hits : handlers must not modify them.
+	"""
+
+	MISS = object()
+
+	def __init__(self, size = 1024, max_line = 256):
+		self.size = size
+		self.max_line = max_line
+		self.recent = {}
+		self.older = {}
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, line):
+		"""
+		Return the cached record of the line, or MISS.
+		"""
+		if len(line) <= self.max_line:
+			record = self.recent.get(line, self.MISS)
+			if record is self.MISS:
+				record = self.older.get(line, self.MISS)
+				if record is not self.MISS:
+					self.put(line, record)
+			if record is not self.MISS:
+				self.hits += 1
+				return record
+		self.misses += 1
+		return self.MISS
+
+	def put(self, line, record):
+		if len(line) > self.max_line:
+			return
+		if len(self.recent) >= max(1, self.size // 2):
+			self.older = self.recent
+			self.recent = {}
+		self.recent[line] = record
+
+	def __len__(self):
+		return len(self.recent) + len(self.older)
+
+	def hit_rate(self):
+		lookups = self.hits + self.misses
+		return float(self.hits) / lookups if lookups else 0.
+
+# ========== PARSER ==========
+
+class GdbMIParser(object):
+	"""
+	Parses lines of gdb output, calling the visitor's handler for each record.
+	Unless lazy is unset, the results of records are decoded on demand (see LazyStruct).
+	Unless cache_size is 0, the records of repeated lines are kept in a RecordCache (self.cache).
+	"""
+	def __init__(self, visitor, lazy = True, cache_size = 1024):
+		self.V = visitor
+		self.lazy = lazy
+		self.cache = RecordCache(cache_size) if cache_size else None
+
+	def parse(self, line):
+		"""
+		Return False if the line could not be parsed.
+		"""
+		cache = self.cache
+		record = RecordCache.MISS if cache is None else cache.get(line)
+		if record is RecordCache.MISS:
+			try:
+				record = parse_record(line, self.lazy)
+			except NoMatch:
+				return False
+			if cache is not None:
+				cache.put(line, record)
+		if record is not None:
+			method, args = record
+			getattr(self.V, method)(*args)
+		return True
+
+if __name__ == '__main__':
+
+	class Visitor(object):
+		def __getattr__(self, name):
+			def handler(*args):
+				print "GOT: %s %s" % (name, repr(args))
+			return handler
+
+	inputstr = '1000003*stopped,reason="breakpoint-hit",bkptno="1",thread-id="0",frame={addr="0x08048428",func="main",args=[{name="argc",value="1"},{name="argv",value="0xbfbb3cb4"}],file="hello.c",fullname="/some/path/to/hello.c",line="16"}\n'
+	print GdbMIParser(Visitor()).parse(inputstr)
@@ -0,0 +1,170 @@
+import logging
+import threading
+import traceback
+from collections import deque
+
+class HandlerPool(object):
+	"""
+	Runs response handlers on a fixed number of worker threads.
+
+	Tasks are started in the order they are submitted.
+	Tasks submitted with the same key run one at a time, in submission order ;
+	tasks with different keys may run concurrently. A pool of size 1 runs everything in order.
+
+	A handler waiting for a gdb response must do so within blocking() :
+	the response needs a worker to be handled, so another one is started while it waits,
+	and the tasks submitted after it with the same key may run meanwhile.
+	"""
+
+	NO_KEY = object()
+
+	def __init__(self, size = 4, name = "GdbHandler"):
+		self.size = size
+		self.name = name
+		self.cond = threading.Condition()
+		self.ready = deque() # keys whose first task can run
+		self.queues = {} # key -> deque of (func, args), for the keys with a task running or waiting
+		self.threads = []
+		self.idle = 0
+		self.blocked = 0 # workers waiting within blocking()
+		self.local = threading.local()
+		self.closed = False
+		self.errlog = logging.getLogger("gdberr")
+		# metrics
+		self.depth = 0 # tasks submitted and not completed
+		self.max_depth = 0
+		self.submitted = 0
+		self.completed = 0
+
+	def submit(self, key, func, *args):
+		with self.cond:
+			if self.closed:
+				raise ValueError("HandlerPool is closed")
+			self.submitted += 1
+			self.depth += 1
+			self.max_depth = max(self.max_depth, self.depth)
+			queue = self.queues.get(key)
+			if queue is not None:
+				# runs once the tasks before it with that key are done
+				queue.append((func, args))
+				return
+			self.queues[key] = deque([(func, args)])
+			self.ready.append(key)
+			if self.idle == 0 and self._active() < self.size:
+				self._start_worker()
+			else:
+				self.cond.notify()
+
+	def _active(self):
+		return len(self.threads) - self.blocked
+
+	def _start_worker(self):
+		thread = threading.Thread(target = self._work, name = "%s-%d" % (self.name, len(self.threads)))
+		thread.setDaemon(True)
+		self.threads.append(thread)
+		thread.start()
+
+	def in_worker(self):
+		return getattr(self.local, 'worker', False)
+
+	def blocking(self):
+		"""
+		Return a context to wait in : called from a worker, it lets another worker take its place meanwhile.
+		"""
+		return _Blocking(self)
+
+	def _work(self):
+		self.local.worker = True
+		while True:
+			with self.cond:
+				while not self.ready and not self.closed:
+					self.idle += 1
+					self.cond.wait()
+					self.idle -= 1
+				if self.closed:
+					self.threads.remove(threading.current_thread())
+					return
+				key = self.ready.popleft()
+				func, args = self.queues[key][0]
+				self.local.key = key # until the task blocks
+			try:
+				func(*args)
+			except Exception:
+				self.errlog.error(traceback.format_exc())
+			with self.cond:
+				self.completed += 1
+				self.depth -= 1
+				self._release_key()
+				if self._active() > self.size:
+					# started while a worker was blocked, which is now back
+					self.threads.remove(threading.current_thread())
+					if self.ready:
+						self.cond.notify()
+					return
+
+	def _release_key(self):
+		"""
+		Let the next task with the key of the current task run.
+		"""
+		# with self.cond held
+		key = self.local.key
+		if key is self.NO_KEY:
+			return
+		self.local.key = self.NO_KEY
+		queue = self.queues[key]
+		queue.popleft()
+		if queue:
+			self.ready.append(key)
+		else:
+			del self.queues[key]
+
+	def close(self):
+		"""
+		Stop the workers once their current task is done, and wait for them.
+		The tasks not started yet are dropped.
+		"""
+		with self.cond:
+			self.closed = True
+			self.cond.notifyAll()
+			threads = list(self.threads)
+		for thread in threads:
+			if thread is not threading.current_thread():
+				thread.join()
+
+	def stats(self):
+		"""
+		Return the pool size and queue metrics, as a dict.
+		"""
+		with self.cond:
+			return {
+				'size': self.size,
+				'threads': len(self.threads),
+				'blocked': self.blocked,
+				'depth': self.depth,
+				'max_depth': self.max_depth,
+				'submitted': self.submitted,
+				'completed': self.completed,
+			}
+
+class _Blocking(object):
+	def __init__(self, pool):
+		self.pool = pool
+		self.worker = pool.in_worker()
+
+	def __enter__(self):
+		if self.worker:
+			pool = self.pool
+			with pool.cond:
+				pool.blocked += 1
+				pool._release_key()
+				if pool.ready:
+					if pool.idle > 0:
+						pool.cond.notify()
+					elif pool._active() < pool.size:
+						pool._start_worker()
+
+	def __exit__(self, exc_type, exc_value, tb):
+		if self.worker:
+			with self.pool.cond:
+				self.pool.blocked -= 1
+		return False
@@ -0,0 +1,172 @@
+import os
+import fcntl
+import errno
+import select
+import logging
+import threading
+import traceback
+
+from line_reader import LineReader
+
+class EpollPoller(object):
+	def __init__(self):
+		self.epoll = select.epoll()
+
+	def register(self, fd):
+		self.epoll.register(fd, select.EPOLLIN)
+
+	def unregister(self, fd):
+		self.epoll.unregister(fd)
+
+	def poll(self):
+		return [ fd for fd, events in self.epoll.poll() ]
+
+	def close(self):
+		self.epoll.close()
+
+class SelectPoller(object):
+	def __init__(self):
+		self.fds = set()
+
+	def register(self, fd):
+		self.fds.add(fd)
+
+	def unregister(self, fd):
+		self.fds.discard(fd)
+
+	def poll(self):
+		readable, _, _ = select.select(list(self.fds), [], [])
+		return readable
+
+	def close(self):
+		self.fds.clear()
+
+def make_poller():
+	if hasattr(select, 'epoll'):
+		return EpollPoller()
+	return SelectPoller()
+
+class IOLoop(object):
+	"""
+	Reads several pipes from a single thread.
+
+	Each stream is registered with a handler, called from the loop with the list of
+	lines each read completes, in the order the data arrives.
+	Streams are closed at end of file, at which point their on_close callback is called.
+	The loop runs until stop() is called ; streams may be added while it runs.
+	close() stops it and releases its own file descriptors : the streams are left to their owners.
+	Called from the loop itself (eg. by an on_close callback), it only stops it, and the loop releases
+	its file descriptors on its way out.
+	"""
+
+	def __init__(self):
+		self.poller = make_poller()
+		self.readers = {} # fd -> (LineReader, on_lines, on_close)
+		self.lock = threading.Lock()
+		self.running = False
+		self.closing = False
+		self.thread = None
+		self.errlog = logging.getLogger("gdberr")
+		# written to, to wake up the loop
+		self.wakeup_r, self.wakeup_w = os.pipe()
+		# a full pipe already has a wake up pending
+		fcntl.fcntl(self.wakeup_w, fcntl.F_SETFL, fcntl.fcntl(self.wakeup_w, fcntl.F_GETFL) | os.O_NONBLOCK)
+		self.poller.register(self.wakeup_r)
+
+	def add_reader(self, stream, on_lines, on_close = None):
+		reader = LineReader(stream)
+		with self.lock:
+			self.readers[reader.fd] = (reader, on_lines, on_close)
+			self.poller.register(reader.fd)
+		self._wakeup()
+
+	def remove_reader(self, fd):
+		with self.lock:
+			if self.readers.pop(fd, None) is not None:
+				self.poller.unregister(fd)
+
+	def start(self, name = "IOLoop"):
+		"""
+		Run the loop in a daemon thread.
+		"""
+		self.running = True
+		self.thread = threading.Thread(target = self.run, name = name)
+		self.thread.setDaemon(True)
+		self.thread.start()
+		return self.thread
+
+	def stop(self):
+		self.running = False
+		self._wakeup()
+
+	def close(self):
+		"""
+		Stop the loop, wait for its thread to end and release the loop's own file descriptors.
+		"""
+		self.closing = True
+		self.stop()
+		if self.thread is threading.current_thread():
+			# run() releases them once out of the loop
+			return
+		if self.thread is not None:
+			self.thread.join()
+		self._release()
+
+	def _release(self):
+		with self.lock:
+			if self.wakeup_w is None:
+				return
+			self.readers.clear()
+			self.poller.close()
+			os.close(self.wakeup_r)
+			os.close(self.wakeup_w)
+			self.wakeup_w = None
+
+	def _wakeup(self):
+		with self.lock:
+			if self.wakeup_w is None:
+				return
+			try:
+				os.write(self.wakeup_w, 'x')
+			except OSError:
+				pass
+
+	def _poll(self):
+		while True:
+			try:
+				return self.poller.poll()
+			except (IOError, OSError, select.error), err:
+				if err.args[0] != errno.EINTR:
+					raise
+
+	def run(self):
+		if self.thread is None:
+			# run directly rather than by start(), which sets running itself : a stop() made
+			# before the thread gets here must not be undone
+			self.running = True
+			self.thread = threading.current_thread()
+		while self.running:
+			for fd in self._poll():
+				if fd == self.wakeup_r:
+					os.read(self.wakeup_r, 4096)
+					continue
+				entry = self.readers.get(fd)
+				if entry is None:
+					continue
+				reader, on_lines, on_close = entry
+				lines = reader.feed(reader.read_chunk())
+				if lines:
+					self._call(on_lines, lines)
+				if reader.closed:
+					self.remove_reader(fd)
+					if on_close is not None:
+						self._call(on_close)
+		if self.closing:
+			self._release()
+
+	def _call(self, func, *args):
+		# a failing handler must not stop the other streams
+		try:
+			func(*args)
+		except Exception:
+			self.errlog.error(traceback.format_exc())
@@ -0,0 +1,130 @@
+import mmap
+import tempfile
+import threading
+from array import array
+
+class LineHistory(object):
+	"""
+	The lines read from a stream, in a fixed amount of memory.
+
+	The most recent lines are kept in a ring buffer of `capacity` lines.
+	Older lines are appended to a spill file, and found there through an index of their offsets :
+	reading them goes through a memory map of the file, so that any line can be read back cheaply.
+	Without a spill file (spill = False), older lines are dropped.
+
+	Lines are numbered from the first one ever added ; negative indices and slices work as for lists,
+	indexing a dropped line raises IndexError.
+	Lines are added from one thread, and may be read from any.
+	Once closed, no more lines can be added, and spilled lines can no longer be read.
+	"""
+
+	CAPACITY = 10000
+
+	def __init__(self, capacity = None, spill = True, spill_file = None):
+		"""
+		spill_file is a file open for writing and reading ; by default a temporary file.
+		"""
+		self.capacity = capacity or self.CAPACITY
+		self.lock = threading.Lock()
+		self.ring = [ None ] * self.capacity
+		self.head = 0 # position of the oldest line in the ring
+		self.nring = 0 # number of lines in the ring
+		self.first = 0 # number of the oldest line in the ring
+		self.spill = spill
+		self.spill_file = spill_file
+		self.offsets = array('L') # offset of each spilled line in the spill file
+		self.spill_size = 0
+		self.map = None
+		self.mapped_size = 0
+		self.closed = False
+
+	def __len__(self):
+		return self.first + self.nring
+
+	def append(self, line):
+		self.extend([ line ])
+
+	def extend(self, lines):
+		with self.lock:
+			if self.closed:
+				raise ValueError("LineHistory is closed")
+			evicted = []
+			for line in lines:
+				if self.nring == self.capacity:
+					evicted.append(self.ring[self.head])
+					self.ring[self.head] = line
+					self.head = (self.head + 1) % self.capacity
+				else:
+					self.ring[(self.head + self.nring) % self.capacity] = line
+					self.nring += 1
+			if evicted:
+				self._spill(evicted)
+				self.first += len(evicted)
+
+	def _spill(self, lines):
+		if not self.spill:
+			return
+		if self.spill_file is None:
+			self.spill_file = tempfile.TemporaryFile(prefix = 'mygdb-history-')
+		offset = self.spill_size
+		for line in lines:
+			self.offsets.append(offset)
+			offset += len(line)
+		self.spill_file.seek(self.spill_size)
+		self.spill_file.write(''.join(lines))
+		self.spill_size = offset
+
+	def _spilled(self, i):
+		if self.closed:
+			raise ValueError("LineHistory is closed")
+		if i >= len(self.offsets):
+			raise IndexError("history line %d was dropped" % i)
+		start = self.offsets[i]
+		end = self.offsets[i + 1] if i + 1 < len(self.offsets) else self.spill_size
+		if end > self.mapped_size:
+			# map what was spilled since the last time
+			self.spill_file.flush()
+			if self.map is not None:
+				self.map.close()
+			self.map = mmap.mmap(self.spill_file.fileno(), self.spill_size, access = mmap.ACCESS_READ)
+			self.mapped_size = self.spill_size
+		return self.map[start:end]
+
+	def _get(self, i):
+		if i >= self.first:
+			return self.ring[(self.head + i - self.first) % self.capacity]
+		return self._spilled(i)
+
+	def __getitem__(self, index):
+		with self.lock:
+			size = self.first + self.nring
+			if isinstance(index, slice):
+				return [ self._get(i) for i in xrange(*index.indices(size)) ]
+			if index < 0:
+				index += size
+			if not 0 <= index < size:
+				raise IndexError("history index out of range")
+			return self._get(index)
+
+	def __iter__(self):
+		i = 0
+		while i < len(self):
+			yield self[i]
+			i += 1
+
+	def tail(self, n):
+		"""
+		Return the last n lines.
+		"""
+		return self[max(len(self) - n, 0):]
+
+	def close(self):
+		with self.lock:
+			self.closed = True
+			if self.map is not None:
+				self.map.close()
+				self.map = None
+				self.mapped_size = 0
+			if self.spill_file is not None:
+				self.spill_file.close()
+				self.spill_file = None
@@ -0,0 +1,64 @@
+import os
+import errno
+
+class LineReader(object):
+	"""
+	Reads a pipe in large chunks and splits them into lines.
+
+	Each call to read_lines() does a single read() system call and returns all
+	the lines completed by it, end-of-line characters included.
+	An incomplete trailing line is kept until the rest of it comes in.
+	"""
+
+	CHUNK_SIZE = 1 << 16
+
+	def __init__(self, stream, chunk_size = None):
+		self.fd = stream if isinstance(stream, int) else stream.fileno()
+		self.chunk_size = chunk_size or self.CHUNK_SIZE
+		self.partial = ''
+		self.closed = False
+
+	def read_chunk(self):
+		"""
+		Return the next chunk of raw data, or '' at end of file.
+		"""
+		while True:
+			try:
+				return os.read(self.fd, self.chunk_size)
+			except OSError, err:
+				if err.errno == errno.EINTR:
+					continue
+				if err.errno == errno.EIO:
+					# a pty whose other end is closed
+					return ''
+				raise
+
+	def read_lines(self):
+		"""
+		Block until at least one line is complete and return the list of complete lines.
+		Return an empty list at end of file.
+		"""
+		while not self.closed:
+			lines = self.feed(self.read_chunk())
+			if lines:
+				return lines
+		return []
+
+	def feed(self, data):
+		"""
+		Add data to the buffer and return the lines it completes.
+		Feeding '' marks the end of file and flushes the incomplete line, if any.
+		"""
+		if data == '':
+			self.closed = True
+			partial, self.partial = self.partial, ''
+			return [ partial ] if partial else []
+		end = data.rfind('\n') + 1
+		if end == 0:
+			self.partial += data
+			return []
+		# on '\n' only, as readline() did : not on '\r' and the other characters splitlines() breaks on
+		lines = (self.partial + data[:end]).split('\n')
+		lines.pop() # what follows the last '\n', always empty
+		self.partial = data[end:]
+		return [ line + '\n' for line in lines ]
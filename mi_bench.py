@@ -0,0 +1,406 @@
+"""
+Benchmarks for the GDB/MI output parsers and their result structures.
+
+	python mi_bench.py parsers [-b BACKEND]... [-o OUTPUT] [TRANSCRIPT]...
+		Run each parser backend over recorded gdbout.log transcripts, or over
+		a synthetic corpus if none is given. Report lines/sec, MB/sec, 
+		per-record latency percentiles, peak memory and the hit rate of the 
+		record cache, and append the results as a JSON line to OUTPUT 
+		(default mi_bench.jsonl).
+
+	python mi_bench.py struct-memory [nchildren]
+		Compare the memory held by struct and by the former struct representation.
+
+	python mi_bench.py roundtrip [ncalls]
+		Measure the latency of synchronous commands sent through a GdbSession
+		to a fake gdb that answers each command as soon as it reads it,
+		and the session's latency breakdown by phase.
+
+	python mi_bench.py packrat [maxn]
+		Time a recparse grammar that backtracks exponentially on a^n y^(n-1),
+		with and without packrat memoization (TokenStream(packrat = True)).
+"""
+import os
+import sys
+import re
+import json
+import time
+import pty
+import pickle
+import threading
+import resource
+import platform
+import subprocess
+from optparse import OptionParser
+from timeit import default_timer
+
+import gdbmi_output_parser
+import gdbmi_record_parser
+from gdbmi_output_parser import struct
+from fake_gdb import read_log
+
+# ========== SYNTHETIC RECORDS ==========
+
+def children_listing(nchildren, token = 1000001):
+	"""
+	A -var-list-children response with nchildren children.
+	"""
+	return '%d^done,numchild="%d",children=[%s]\n' % (token, nchildren, ','.join(
+		'child={name="var1.%d",exp="%d",numchild="0",value="%d",type="int"}' % (i, i, i) for i in xrange(nchildren)))
+
+def synthetic_corpus(scale = 1):
+	"""
+	A mix of the records gdb emits while stepping through a program with watched variables :
+	stops, var updates, big children lists and stream records.
+	"""
+	lines = []
+	token = 1000001
+	for step in xrange(200 * scale):
+		lines.append('%d^running\n' % token)
+		lines.append('*running,thread-id="all"\n')
+		lines.append('(gdb) \n')
+		lines.append('@"target output line %d\\n"\n' % step)
+		lines.append('~"Breakpoint %d, main (argc=1, argv=0xbfbb3cb4) at hello.c:%d\\n"\n' % (step % 4, step))
+		lines.append('*stopped,reason="end-stepping-range",thread-id="1",stopped-threads="all",'
+			'frame={addr="0x08048428",func="main",args=[{name="argc",value="1"},{name="argv",value="0xbfbb3cb4"}],'
+			'file="hello.c",fullname="/some/path/to/hello.c",line="%d"}\n' % step)
+		lines.append('(gdb) \n')
+		token += 1
+		lines.append('%d^done,changelist=[%s]\n' % (token, ','.join(
+			'{name="var%d",value="%d",in_scope="true",type_changed="false"}' % (i, step * i) for i in xrange(20))))
+		lines.append('(gdb) \n')
+		token += 1
+		if step % 20 == 0:
+			lines.append(children_listing(1000, token))
+			lines.append('&"warning: big listing \\"%d\\"\\n"\n' % step)
+			token += 1
+	return lines
+
+# ========== TRANSCRIPTS ==========
+
+def load_transcript(source):
+	"""
+	Return the lines of gdb output recorded in a gdbout.log file,
+	or kept by a LineHistory such as GdbController.output_hist.
+	"""
+	return read_log(source)
+
+# ========== PARSERS ==========
+
+def parser_backends():
+	"""
+	Return the list of (name, parser factory) of the available parser backends.
+	"""
+	backends = [
+		('recparse', gdbmi_output_parser.GdbMIParser),
+		('recparse-interpreted', lambda V: gdbmi_output_parser.GdbMIParser(V, compiled = False)),
+		('record', lambda V: gdbmi_record_parser.GdbMIParser(V, lazy = False, cache_size = 0)),
+		('record-lazy', lambda V: gdbmi_record_parser.GdbMIParser(V, lazy = True, cache_size = 0)),
+		('record-cached', lambda V: gdbmi_record_parser.GdbMIParser(V, lazy = True)),
+	]
+	try:
+		import gdbmi_ply
+		backends.append(('ply', gdbmi_ply.GdbMIParser))
+	except ImportError:
+		pass
+	return backends
+
+class NullVisitor(object):
+	def __getattr__(self, name):
+		def handler(*args):
+			pass
+		return handler
+
+def max_rss():
+	"""
+	Peak resident memory of the process, in bytes.
+	"""
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return rss if sys.platform == 'darwin' else rss * 1024
+
+def percentile(sorted_values, p):
+	if not sorted_values:
+		return None
+	return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+def bench_parser(parser_factory, lines):
+	"""
+	Parse the lines one by one and measure the throughput, latency and memory.
+	"""
+	parser = parser_factory(NullVisitor())
+	timer = default_timer
+	latencies = []
+	errors = 0
+	rss0 = max_rss()
+	t0 = timer()
+	for line in lines:
+		t = timer()
+		if not parser.parse(line):
+			errors += 1
+		latencies.append(timer() - t)
+	secs = timer() - t0
+	latencies.sort()
+	nbytes = sum(len(line) for line in lines)
+	cache = getattr(parser, 'cache', None)
+	return {
+		'lines': len(lines),
+		'bytes': nbytes,
+		'errors': errors,
+		'seconds': secs,
+		'lines_per_sec': len(lines) / secs,
+		'mb_per_sec': nbytes / secs / 1e6,
+		'p50_us': percentile(latencies, .5) * 1e6,
+		'p99_us': percentile(latencies, .99) * 1e6,
+		'max_us': latencies[-1] * 1e6,
+		'peak_rss_growth': max_rss() - rss0,
+		'cache_hit_rate': cache.hit_rate() if cache is not None else None,
+	}
+
+def bench_parser_isolated(parser_factory, lines):
+	"""
+	Run bench_parser in a child process, so that peak memory is measured for that backend alone.
+	"""
+	rd, wr = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		os.close(rd)
+		try:
+			out = pickle.dumps(bench_parser(parser_factory, lines))
+		except Exception, err:
+			out = pickle.dumps({ 'error': repr(err) })
+		os.write(wr, out)
+		os.close(wr)
+		os._exit(0)
+	os.close(wr)
+	chunks = []
+	while True:
+		chunk = os.read(rd, 1 << 16)
+		if chunk == '':
+			break
+		chunks.append(chunk)
+	os.close(rd)
+	os.waitpid(pid, 0)
+	return pickle.loads(''.join(chunks))
+
+def git_revision():
+	try:
+		proc = subprocess.Popen(['git', 'rev-parse', 'HEAD'], stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+			cwd = os.path.dirname(os.path.abspath(__file__)))
+		rev = proc.communicate()[0].strip()
+		return rev or None
+	except OSError:
+		return None
+
+def bench_parsers(corpora, backends):
+	"""
+	corpora : list of (name, lines)
+	backends : list of (name, parser factory)
+	Return a JSON serializable report.
+	"""
+	report = {
+		'time': time.time(),
+		'revision': git_revision(),
+		'python': platform.python_version(),
+		'results': [],
+	}
+	for corpus_name, lines in corpora:
+		for backend_name, parser_factory in backends:
+			result = bench_parser_isolated(parser_factory, lines)
+			result['corpus'] = corpus_name
+			result['backend'] = backend_name
+			report['results'].append(result)
+	return report
+
+def print_report(report):
+	print "%-20s %-20s %8s %12s %8s %9s %9s %10s %6s" % ('corpus', 'backend', 'lines', 'lines/sec', 'MB/sec', 'p50 us', 'p99 us', 'peak MB', 'hits')
+	for r in report['results']:
+		if 'error' in r:
+			print "%-20s %-20s %s" % (r['corpus'][-20:], r['backend'], r['error'])
+			continue
+		hits = '' if r.get('cache_hit_rate') is None else '%.0f%%' % (r['cache_hit_rate'] * 100)
+		print "%-20s %-20s %8d %12.0f %8.2f %9.1f %9.1f %10.1f %6s" % (
+			r['corpus'][-20:], r['backend'], r['lines'], r['lines_per_sec'], r['mb_per_sec'],
+			r['p50_us'], r['p99_us'], r['peak_rss_growth'] / 1e6, hits)
+
+# ========== MEMORY ==========
+
+class DictStruct(object):
+	"""
+	The former struct representation, which keeps its fields both in _data and in __dict__.
+	"""
+	def __init__(self, dikt):
+		self._data = dict(dikt)
+		self.__dict__.update(dict(dikt))
+
+def deep_sizeof(obj, seen = None):
+	"""
+	Size in bytes of obj and everything it references, counting shared objects once.
+	Field name strings are counted too.
+	"""
+	if seen is None:
+		seen = set()
+	if id(obj) in seen:
+		return 0
+	seen.add(id(obj))
+	size = sys.getsizeof(obj)
+	if isinstance(obj, dict):
+		for k, v in obj.iteritems():
+			size += deep_sizeof(k, seen) + deep_sizeof(v, seen)
+	elif isinstance(obj, (list, tuple)):
+		for item in obj:
+			size += deep_sizeof(item, seen)
+	elif isinstance(obj, gdbmi_output_parser.StructLayout):
+		size += deep_sizeof(obj.keys, seen) + deep_sizeof(obj.index, seen)
+	elif hasattr(obj, '__dict__'):
+		size += deep_sizeof(obj.__dict__, seen)
+	if isinstance(obj, struct):
+		size += deep_sizeof(obj._layout, seen) + deep_sizeof(obj._values, seen)
+	return size
+
+def struct_memory(nchildren = 100000):
+	"""
+	Parse a children listing eagerly, with the current and the former struct representation,
+	and return the memory held by each result.
+	"""
+	line = children_listing(nchildren)
+	results = {}
+	class Visitor(object):
+		def onResultRecord(self, token, resultClass, res):
+			results['res'] = res
+	parser = gdbmi_record_parser.GdbMIParser(Visitor(), lazy = False)
+	parser.parse(line)
+	current = deep_sizeof(results['res'])
+	def to_dict_struct(val):
+		if isinstance(val, struct):
+			return DictStruct((k, to_dict_struct(v)) for k, v in val._data.iteritems())
+		elif isinstance(val, list):
+			return [ to_dict_struct(v) for v in val ]
+		elif isinstance(val, tuple):
+			return tuple(to_dict_struct(v) for v in val)
+		return val
+	former = deep_sizeof(to_dict_struct(results['res']))
+	return current, former
+
+# ========== ROUND TRIPS ==========
+
+class EchoGdb(object):
+	"""
+	Stands for a GdbMI instance : answers every command with ^done as soon as it reads it.
+	"""
+	def __init__(self):
+		r, self.outw = os.pipe()
+		self.gdbout = os.fdopen(r, 'r', 0)
+		r, self.errw = os.pipe()
+		self.gdberr = os.fdopen(r, 'r', 0)
+		master, self.slave = pty.openpty()
+		self.targetio = os.fdopen(master, 'rw', 0)
+		r, w = os.pipe()
+		self.gdbin = os.fdopen(w, 'w', 0)
+		self.commands = os.fdopen(r, 'r', 0)
+		thread = threading.Thread(target = self.answer)
+		thread.setDaemon(True)
+		thread.start()
+
+	def answer(self):
+		for line in iter(self.commands.readline, ''):
+			token = TOKEN_RE.match(line).group()
+			os.write(self.outw, '%s^done,value="1"\n(gdb) \n' % token)
+
+TOKEN_RE = re.compile(r'[0-9]*')
+
+def bench_roundtrip(ncalls = 2000):
+	"""
+	Return the latencies of ncalls synchronous commands, in seconds, sorted,
+	and the CommandStats of the session.
+	"""
+	import pygdb
+	session = pygdb.GdbSession(EchoGdb())
+	latencies = []
+	timer = default_timer
+	for i in xrange(ncalls):
+		t = timer()
+		session.controller.data_eval('1', on_response = lambda res: res, sync = True)
+		latencies.append(timer() - t)
+	latencies.sort()
+	return latencies, session.command_stats
+
+# ========== PACKRAT ==========
+
+def backtracking_grammar():
+	"""
+	S = 'a' S 'x' | 'a' S 'y' | 'a' : on a^n y^(n-1), each level parses the rest twice.
+	"""
+	from recparse import Forward, Terminal
+	S = Forward()
+	S << ((Terminal('a') + S + Terminal('x')) | (Terminal('a') + S + Terminal('y')) | Terminal('a'))
+	return S
+
+def bench_packrat(sizes, max_backtracking = 16):
+	"""
+	Return (n, seconds without memoization or None beyond max_backtracking, seconds with memoization).
+	"""
+	from recparse import TokenStream
+	grammar = backtracking_grammar()
+	def parse_time(text, packrat):
+		stream = TokenStream(iter(text), packrat = packrat)
+		t = default_timer()
+		success, result = grammar.try_parse(stream)
+		elapsed = default_timer() - t
+		assert success and stream.savepoint() == len(text)
+		return elapsed
+	rows = []
+	for n in sizes:
+		text = 'a' * n + 'y' * (n - 1)
+		plain = parse_time(text, False) if n <= max_backtracking else None
+		rows.append((n, plain, parse_time(text, True)))
+	return rows
+
+if __name__ == '__main__':
+
+	if len(sys.argv) < 2 or sys.argv[1] not in ('parsers', 'struct-memory', 'roundtrip', 'packrat'):
+		print __doc__
+		sys.exit(1)
+
+	if sys.argv[1] == 'parsers':
+		optparser = OptionParser(usage = "%prog parsers [-b BACKEND]... [-o OUTPUT] [TRANSCRIPT]...")
+		optparser.add_option('-b', '--backend', action = 'append', dest = 'backends', default = [])
+		optparser.add_option('-o', '--output', dest = 'output', default = 'mi_bench.jsonl')
+		optparser.add_option('-s', '--scale', dest = 'scale', type = 'int', default = 1,
+			help = "size of the synthetic corpus")
+		options, paths = optparser.parse_args(sys.argv[2:])
+
+		backends = parser_backends()
+		if options.backends:
+			backends = [ (name, factory) for (name, factory) in backends if name in options.backends ]
+		if paths:
+			corpora = [ (path, load_transcript(path)) for path in paths ]
+		else:
+			corpora = [ ('synthetic', synthetic_corpus(options.scale)) ]
+
+		report = bench_parsers(corpora, backends)
+		print_report(report)
+		out = file(options.output, 'a')
+		out.write(json.dumps(report) + '\n')
+		out.close()
+
+	elif sys.argv[1] == 'struct-memory':
+		nchildren = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+		current, former = struct_memory(nchildren)
+		print "%d children : struct %.1f MB, former struct %.1f MB (%.1fx)" % (
+			nchildren, current / 1e6, former / 1e6, float(former) / current)
+
+	elif sys.argv[1] == 'roundtrip':
+		ncalls = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+		cpu0 = time.clock()
+		latencies, stats = bench_roundtrip(ncalls)
+		cpu = time.clock() - cpu0
+		print "%d sync calls : p50 %.1f us, p99 %.1f us, max %.1f us, %.1f us CPU per call" % (
+			ncalls, percentile(latencies, .5) * 1e6, percentile(latencies, .99) * 1e6, latencies[-1] * 1e6, cpu / ncalls * 1e6)
+		print
+		print stats.report()
+
+	elif sys.argv[1] == 'packrat':
+		maxn = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+		print "%6s %15s %15s" % ('n', 'backtracking s', 'packrat s')
+		for n, plain, packrat in bench_packrat(range(4, maxn + 1, 4)):
+			print "%6d %15s %15.5f" % (n, '-' if plain is None else '%.5f' % plain, packrat)
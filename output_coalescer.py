@@ -0,0 +1,182 @@
+import time
+import logging
+import threading
+import traceback
+from collections import deque
+
+class RateCounter(object):
+	"""
+	A running total, and its rate per second over the last `window` seconds.
+	"""
+	def __init__(self, window = 1.):
+		self.window = window
+		self.total = 0
+		self.samples = deque([ (time.time(), 0) ])
+
+	def add(self, n):
+		self.total += n
+		now = time.time()
+		self.samples.append((now, self.total))
+		while len(self.samples) > 2 and self.samples[1][0] < now - self.window:
+			self.samples.popleft()
+
+	def rate(self):
+		now = time.time()
+		t0, total0 = self.samples[0]
+		if now - t0 < 1e-3:
+			return 0.
+		return (self.total - total0) / (now - t0)
+
+class OutputCoalescer(object):
+	"""
+	Delivers the lines of a LineHistory to a listener in blocks, from a thread of its own,
+	so that a stream printing many small lines costs the listener a few calls per second
+	and never holds up the thread adding the lines.
+
+	A block is delivered at most max_latency seconds after its first line was fed,
+	or as soon as max_block bytes are pending. A block is a string of whole lines.
+
+	When the listener falls behind :
+		'spill' : the pending lines are read back from the history, which spills them to disk :
+			the listener gets all the output, late ;
+		'drop' : beyond max_pending bytes, the oldest pending lines are skipped and counted as dropped.
+	"""
+
+	MAX_LINES = 1024 # lines read from the history at a time
+
+	def __init__(self, history, deliver, max_latency = .02, max_block = 1 << 16, max_pending = 1 << 20, policy = 'spill', name = "OutputCoalescer"):
+		if policy not in ('spill', 'drop'):
+			raise ValueError("Unknown output policy : %s" % policy)
+		self.history = history
+		self.deliver = deliver
+		self.max_latency = max_latency
+		self.max_block = max_block
+		self.max_pending = max_pending
+		self.policy = policy
+		self.name = name
+		self.cond = threading.Condition()
+		self.cursor = len(history) # next line to deliver
+		self.pending_bytes = 0
+		self.first_pending = None # time the first line pending was fed
+		self.thread = None
+		self.running = True
+		self.errlog = logging.getLogger("gdberr")
+		# counters
+		self.bytes_in = RateCounter()
+		self.bytes_out = RateCounter()
+		self.dropped_bytes = 0
+		self.blocks = 0
+
+	def feed(self, lines):
+		"""
+		Add lines to the history, to be delivered.
+		"""
+		nbytes = sum(len(line) for line in lines)
+		with self.cond:
+			self.history.extend(lines)
+			self.bytes_in.add(nbytes)
+			if self.pending_bytes == 0:
+				self.first_pending = time.time()
+			self.pending_bytes += nbytes
+			if self.thread is None:
+				self.thread = threading.Thread(target = self.run, name = self.name)
+				self.thread.setDaemon(True)
+				self.thread.start()
+			self.cond.notify()
+
+	def stop(self):
+		"""
+		Stop delivering and wait for the delivery thread to end. Lines not delivered yet never are.
+		"""
+		with self.cond:
+			self.running = False
+			self.cond.notify()
+			thread = self.thread
+		if thread is not None and thread is not threading.current_thread():
+			thread.join()
+
+	def run(self):
+		while True:
+			with self.cond:
+				while self.running and self.pending_bytes == 0:
+					self.cond.wait()
+				if not self.running:
+					return
+				delay = self.first_pending + self.max_latency - time.time()
+				full = self.pending_bytes >= self.max_block
+			if delay > 0 and not full:
+				# give the block time to fill up ; a timed wait would not wake up any sooner
+				time.sleep(delay)
+			self._deliver_pending()
+
+	def _deliver_pending(self):
+		with self.cond:
+			end = len(self.history)
+			pending, self.pending_bytes = self.pending_bytes, 0
+			if self.policy == 'drop' and pending > self.max_pending:
+				pending = self._drop(end, pending)
+		delivered = 0
+		while self.cursor < end:
+			lines = self._read(self.cursor, min(end, self.cursor + self.MAX_LINES))
+			block = []
+			size = 0
+			for line in lines:
+				if block and size + len(line) > self.max_block:
+					break
+				block.append(line)
+				size += len(line)
+			self.cursor += len(block)
+			delivered += size
+			with self.cond:
+				self.bytes_out.add(size)
+				self.blocks += 1
+			try:
+				self.deliver(''.join(block))
+			except Exception:
+				self.errlog.error(traceback.format_exc())
+		if delivered < pending:
+			with self.cond:
+				self.dropped_bytes += pending - delivered
+
+	def _read(self, start, end):
+		try:
+			return self.history[start:end]
+		except IndexError:
+			# dropped by the history itself : counted as dropped
+			return [ '' ] * (end - start)
+
+	def _drop(self, end, pending):
+		"""
+		Skip the oldest pending lines, keeping the last max_pending bytes.
+		Return the number of bytes kept.
+		"""
+		kept = 0
+		start = end
+		while start > self.cursor:
+			try:
+				line = self.history[start - 1]
+			except IndexError:
+				break
+			if kept + len(line) > self.max_pending:
+				break
+			kept += len(line)
+			start -= 1
+		self.errlog.warning("%s : %d bytes dropped" % (self.name, pending - kept))
+		self.dropped_bytes += pending - kept
+		self.cursor = start
+		return kept
+
+	def stats(self):
+		"""
+		Return the byte counters and rates, as a dict.
+		"""
+		with self.cond:
+			return {
+				'bytes_in': self.bytes_in.total,
+				'bytes_out': self.bytes_out.total,
+				'in_rate': self.bytes_in.rate(),
+				'out_rate': self.bytes_out.rate(),
+				'pending_bytes': self.pending_bytes,
+				'dropped_bytes': self.dropped_bytes,
+				'blocks': self.blocks,
+			}
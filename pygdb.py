@@ -10,37 +10,147 @@ from collections import defaultdict
 import traceback
 from select import select
 
-import recparse
-import gdbmi_output_parser
+import gdbmi_record_parser
+from io_loop import IOLoop
+from gdb_future import GdbError, GdbFuture, PendingRequests, EventIterator
+from handler_pool import HandlerPool
+from line_history import LineHistory
+from output_coalescer import OutputCoalescer
+from command_writer import CommandWriter
+from command_stats import CommandStats
 from gdb_commands import GdbCommandBuilder
 from event import EventSlot, EventQueue
 from var import Var
 from watch import FilteredWatch
 
 class GdbMI(object):
-	def __init__(self):
-		master, slave = pty.openpty()
+	
+	GDB = "gdb"
+	
+	def __init__(self, gdb = None):
+		"""
+		gdb is the gdb binary, or the command line of a stand-in such as fake_gdb.
+		"""
+		master, self.slave = pty.openpty()
 		self.targetio = os.fdopen(master, 'rw')
-		tty = os.ttyname(slave)
-		self.proc = subprocess.Popen(["gdb", "--tty=%s" % tty, "--interpreter=mi"], 0, None, subprocess.PIPE, subprocess.PIPE, subprocess.PIPE)
+		tty = os.ttyname(self.slave)
+		command = gdb or self.GDB
+		if isinstance(command, basestring):
+			command = [ command ]
+		self.proc = subprocess.Popen(list(command) + ["--tty=%s" % tty, "--interpreter=mi"], 0, None, subprocess.PIPE, subprocess.PIPE, subprocess.PIPE)
 		self.gdbin = self.proc.stdin
 		self.gdbout = self.proc.stdout
 		self.gdberr = self.proc.stderr
-
-class SafeThread(threading.Thread):
-	def __init__(self, **kwargs):
-		target = kwargs['target']
-		self.errlog = logging.getLogger("gdberr")
-		def safe_target(*args, **kwargs):
+		# the executable whose symbols gdb has loaded before the session started (see gdb_pool)
+		self.executable = None
+	
+	def kill(self):
+		"""
+		Terminate gdb, and wait for it to exit.
+		"""
+		if self.proc.poll() is None:
+			try:
+				self.proc.kill()
+			except OSError:
+				pass
+		self.proc.wait()
+	
+	def close(self):
+		"""
+		Terminate gdb and close its streams and the target's terminal.
+		Whoever reads or writes them must be done first (see GdbSession.close).
+		"""
+		self.kill()
+		for stream in (self.gdbin, self.gdbout, self.gdberr, self.targetio):
 			try:
-				target(*args, **kwargs)
-			except Exception, e:
-				self.errlog.error(traceback.format_exc())
-		kwargs['target'] = safe_target
-		threading.Thread.__init__(self, **kwargs)
+				stream.close()
+			except IOError:
+				pass
+		if self.slave is not None:
+			os.close(self.slave)
+			self.slave = None
+
+def gdbmi_parser_backend(name):
+	"""
+	Return the GDB/MI parser class of a backend : 
+		'record' : gdbmi_record_parser (the default)
+		'recparse' : gdbmi_output_parser, the reference implementation
+		'ply' : gdbmi_ply (requires PLY)
+	"""
+	if name == 'record':
+		return gdbmi_record_parser.GdbMIParser
+	elif name == 'recparse':
+		import gdbmi_output_parser
+		return gdbmi_output_parser.GdbMIParser
+	elif name == 'ply':
+		import gdbmi_ply
+		return gdbmi_ply.GdbMIParser
+	raise ValueError("Unknown GDB/MI parser backend : %s" % name)
+
+class CommandBatch(object):
+	"""
+	Collects the commands sent from one thread, and writes them to gdb in a single write when it closes :
+	gdb then answers them in a burst, and the responses are matched to their futures by token.
+
+		with session.batch() as futures:
+			for child in children:
+				session.var_eval(child)
+		values = wait_all(futures)
+
+	The futures of the commands sent while the batch is open are appended to the list it returns.
+	A batch opened within a batch writes its commands with the outer one.
+	A synchronous command sent within a batch writes the pending commands before it waits.
+	"""
+
+	def __init__(self, controller):
+		self.controller = controller
+		self.outer = None
+		self.lines = [] # (line, token)
+		self.futures = []
+
+	def __enter__(self):
+		self.outer = self.controller.current_batch()
+		if self.outer is not None:
+			self.lines = self.outer.lines
+		self.controller._batches.current = self
+		return self.futures
+
+	def __exit__(self, exc_type, exc_value, tb):
+		# write even if the block raised : the commands already sent have futures waiting for them
+		self.controller._batches.current = self.outer
+		if self.outer is None:
+			self.flush()
+		return False
+
+	def add_future(self, future):
+		batch = self
+		while batch is not None:
+			batch.futures.append(future)
+			batch = batch.outer
+
+	def flush(self):
+		"""
+		Write the pending commands to gdb.
+		"""
+		if self.lines:
+			lines, keys = zip(*self.lines)
+			del self.lines[:]
+			self.controller.writer.write_lines(lines, keys)
 
 class GdbController(GdbCommandBuilder):
-	def __init__(self, gdb_instance, output_handler, target_output_handler):
+	
+	# see gdbmi_parser_backend()
+	gdbmi_parser_class = gdbmi_record_parser.GdbMIParser
+	
+	# target output is handed over in blocks (see OutputCoalescer)
+	TARGET_OUTPUT_LATENCY = .02
+	TARGET_OUTPUT_POLICY = 'spill'
+	
+	def __init__(self, gdb_instance, output_handler, target_output_handler, io_loop = None):
+		"""
+		gdb output, gdb errors and target output are all read by io_loop.
+		If no loop is given, the controller runs its own, in a thread of its own.
+		"""
 		self.gdb = gdb_instance
 		self.output_handler = output_handler
 		self.target_output_handler = target_output_handler
@@ -51,46 +161,89 @@ class GdbController(GdbCommandBuilder):
 		self.gdberrlog = logging.getLogger("gdberr") # log gdb errors
 		self.targetlog = logging.getLogger("targetout") # log target output
 		
-		self.output_hist = []
-		self.target_hist = []
-		
-		self.target_output_thread = threading.Thread(target = self._target_output_thread, args = [self.gdb.targetio])
-		self.target_output_thread.setDaemon(True)
-		self.target_output_thread.start()
+		# recent lines in memory, older ones spilled to disk ;
+		# read by the tui, and replayed by fake_gdb (Transcript.load(input_hist, output_hist))
+		self.input_hist = LineHistory()
+		self.output_hist = LineHistory()
+		self.target_hist = LineHistory()
+		self.target_output = OutputCoalescer(self.target_hist, self._deliver_target_output,
+			max_latency = self.TARGET_OUTPUT_LATENCY, policy = self.TARGET_OUTPUT_POLICY, name = "TargetOutput")
 		
-		self.gdbmi_output_lexer = gdbmi_output_parser.lex
-		self.gdbmi_output_parser = gdbmi_output_parser.gdbmi_output(self.output_handler)
+		self.gdbmi_parser = self.gdbmi_parser_class(self.output_handler)
+		self._batches = threading.local()
+		self.writer = CommandWriter(self.gdb.gdbin, self._commands_written)
+		self.read_time = None # when the output being parsed was read
 		
-		self.gdb_output_thread = threading.Thread(target = self._gdb_raw_output_thread, args = [self.gdb.gdbout])
-		self.gdb_output_thread.setDaemon(True)
-		self.gdb_output_thread.start()
-		
-		self.gdb_error_thread = threading.Thread(target = self._gdb_error_thread, args = [self.gdb.gdberr])
-		self.gdb_error_thread.setDaemon(True)
-		self.gdb_error_thread.start()
+		self.own_io_loop = io_loop is None
+		if io_loop is None:
+			io_loop = IOLoop()
+			io_loop.start("GdbController")
+		self.io_loop = io_loop
+		io_loop.add_reader(self.gdb.targetio, self._handle_target_lines, lambda: self.log.debug("(TARGET stdout : closes)"))
+		io_loop.add_reader(self.gdb.gdbout, self._handle_output_lines, lambda: self.log.debug("GDB: Finished"))
+		io_loop.add_reader(self.gdb.gdberr, self._handle_error_lines, lambda: self.log.debug("(GDB stderr : closes)"))
 
+	def close(self):
+		"""
+		Stop writing to and reading from gdb, and release what the controller holds :
+		its I/O loop if it runs its own, the target output thread and the history files.
+		gdb and its streams are left to their owner (see GdbMI.close).
+		"""
+		self.writer.close()
+		if self.own_io_loop:
+			self.io_loop.close()
+		else:
+			for stream in (self.gdb.targetio, self.gdb.gdbout, self.gdb.gdberr):
+				self.io_loop.remove_reader(stream.fileno())
+		self.target_output.stop()
+		self.input_hist.close()
+		self.output_hist.close()
+		self.target_hist.close()
+	
 	def raw_send(self, command):
-		self.gdb.gdbin.write(command.strip())
-		self.gdb.gdbin.write("\n")
+		self._write_line(command.strip())
 	
 	def _send(self, command, token = None):
 		cmdline = "%s%s" % (str(token), command.strip())
 		self.gdbinlog.debug(cmdline)
-		self.gdb.gdbin.write(cmdline)
-		self.gdb.gdbin.write("\n")
+		self.input_hist.append(cmdline + '\n')
+		self._write_line(cmdline, token)
+	
+	def _write_line(self, line, token = None):
+		batch = self.current_batch()
+		if batch is not None:
+			batch.lines.append((line, token))
+			return
+		self.writer.write(line, token)
+	
+	def _commands_written(self, records):
+		"""
+		Called by the writer with the (token, enqueue time, write time) of the lines it wrote.
+		Does nothing : subclasses may record the timings (see GdbSession).
+		"""
+		pass
+	
+	def batch(self):
+		"""
+		Return a CommandBatch collecting the commands sent from the calling thread.
+		"""
+		return CommandBatch(self)
+	
+	def current_batch(self):
+		"""
+		Return the innermost batch open in the calling thread, or None.
+		"""
+		return getattr(self._batches, 'current', None)
 	
-	def _gdb_raw_output_thread(self, stream):
-		while True:
-			line = stream.readline()
-			if line == '': break
+	def _handle_output_lines(self, lines):
+		self.read_time = time.time()
+		for line in lines:
 			self.gdblog.debug(line)
-			self.output_hist.append(line)
+		self.output_hist.extend(lines)
 
+		for line in lines:
 			try:
-				charstream = recparse.TokenStream(iter(line))
-				tokenstream = self.gdbmi_output_lexer.lex(charstream)
-				success, result = self.gdbmi_output_parser.try_parse(tokenstream)
-				if not success:
+				if not self.gdbmi_parser.parse(line):
 					self.log.error("GDBMI parse error on input : %s" % line)
 					continue
 			except SyntaxError, err:
@@ -98,24 +251,18 @@ class GdbController(GdbCommandBuilder):
 			except Exception, err:
 				self.log.error("GDBMI error : %s" % err.message)
 	
-		self.log.debug("GDB: Finished")
-	
-	def _gdb_error_thread(self, stream):
-		while True:
-			line = stream.readline()
-			if line == '': break
+	def _handle_error_lines(self, lines):
+		for line in lines:
 			self.gdberrlog.debug(line)
-		self.log.debug("(GDB stderr : closes)")
-	
-	def _target_output_thread(self, stream):
-		while True:
-			line = stream.readline()
-			if line == '': break
-			#self.log.debug("TARGET says: %s" % line)
-			self.targetlog.debug(line)
-			self.target_hist.append(line)
-			self.target_output_handler(line)
-		self.log.debug("(TARGET stdout : closes)")
+	
+	def _handle_target_lines(self, lines):
+		self.target_output.feed(lines)
+	
+	def _deliver_target_output(self, block):
+		if self.targetlog.isEnabledFor(logging.DEBUG):
+			for line in block.splitlines(True):
+				self.targetlog.debug(line)
+		self.target_output_handler(block)
 
 class GdbSession(object):
 	"""
@@ -130,42 +277,42 @@ class GdbSession(object):
 	class MyGdbController(GdbController):
 		def __init__(self, session):
 			self.session = session
-			self.next_token = 1000001
 			# MUST come last
 			GdbController.__init__(self, session.gdb, session, session.onTargetOutput)
 
-		class SyncCallback(object):
-			def __init__(self, callback):
-				self.callback = callback
-				self.got_response = False
-				self.response = None
-			def __call__(self, *args, **kwargs):
-				self.response = self.callback(*args, **kwargs)
-				self.got_response = True
-				return self.response
+		SYNC_TIMEOUT = 10.
 
 		def _send(self, command, token = None, on_response = None, sync = False):
+			"""
+			Return a GdbFuture of the response, resolved with the value returned by on_response
+			or, without on_response, with the result record.
+			If sync is set, wait for the response and return that value instead : 
+			a GdbError is raised if gdb answers with an error.
+			"""
 			if token is None:
-				token = self.next_token
-				self.next_token += 1
-			if on_response is not None:
-				if not sync:
-					self.session._response_handlers[str(token)] = on_response
-				else:
-					on_response_sync = self.SyncCallback(on_response)
-					self.session._response_handlers[str(token)] = on_response_sync
+				token = self.session._requests.new_token()
+			future = self.session._requests.add(token, on_response)
+			self.session.command_stats.sent(token, command)
 			self.session._accept_input = False
 			# MUST come last
 			GdbController._send(self, command, token=token)
+			batch = self.current_batch()
+			if batch is not None:
+				batch.add_future(future)
 			if sync:
-				TIMEOUT = 10.
+				if batch is not None:
+					batch.flush()
 				t0 = time.time()
-				while self.session._response_handlers.has_key(str(token)) :#and not on_response_sync.got_response:
-					time.sleep(0.001)
-					if time.time() - t0 > TIMEOUT:
-						raise Exception, "Timeout : request %s" % token
-				self.session.log.debug("Got sync response in %f seconds" % (time.time() - t0))
-				return on_response_sync.response
+				try:
+					with self.session._handlers.blocking():
+						return future.result(self.SYNC_TIMEOUT)
+				finally:
+					self.session.log.debug("Got sync response in %f seconds" % (time.time() - t0))
+			return future
+		
+		def _commands_written(self, records):
+			GdbController._commands_written(self, records)
+			self.session.command_stats.written(records)
 	
 	_frame = None
 	_breakpoints = {} # num -> bkpt desc
@@ -179,13 +326,25 @@ class GdbSession(object):
 	_accept_input = True
 	accept_input = property(lambda self: self._accept_input)
 	
-	def __init__(self, gdbinst):
+	HANDLER_THREADS = 4
+
+	def __init__(self, gdbinst, handler_pool = None):
+		"""
+		Response handlers run on handler_pool (a HandlerPool),
+		by default a pool of HANDLER_THREADS threads of the session's own.
+		They change the state of the session (vars, breakpoints, watches) : they run one at a time,
+		in the order of the responses, but for those waiting for gdb (see HandlerPool.blocking).
+		"""
 		self.gdb = gdbinst
 		self.log = logging.getLogger("gdb")
+		self._requests = PendingRequests()
+		self.command_stats = CommandStats()
+		self._own_handlers = handler_pool is None
+		if handler_pool is None:
+			handler_pool = HandlerPool(self.HANDLER_THREADS)
+		self._handlers = handler_pool
 		self.controller = self.MyGdbController(self)
 		
-
-		self._response_handlers = {}
 		
 		self._vars = {} # name -> var
 		self._watchers = defaultdict(lambda: {})
@@ -207,7 +366,7 @@ class GdbSession(object):
 		self.onWatchUpdate = EventSlot() # var
 		self.eventGdbOutput = EventSlot() # msg
 		self.eventGdbErr = EventSlot() # msg
-		self.eventTargetOutput = EventSlot() # msg
+		self.eventTargetOutput = EventSlot() # msg : one or more lines of target output
 
 	def err_check_response(self, on_response):
 		def on_response_or_err(response):
@@ -223,24 +382,41 @@ class GdbSession(object):
 	
 	def _handle_results(self, token, resultClass, results):
 		self.LAST_RESULT = results
+		future, handler = self._requests.pop(token)
+		self.command_stats.parsed(token, self.controller.read_time, error = resultClass == 'error')
 		if resultClass == 'error':
 			self.log.debug("ERROR ENCOUNTERED: %s" % repr(results))
-			if self._response_handlers.has_key(token):
+			errmsg = results.get('msg') if results is not None else None
+			if handler is not None:
 				self.log.debug("CANCELLING HANDLER FOR %s" % repr(token))
-				self._response_handlers.pop(token)
+			if future is not None:
+				# raised to whoever waits for the response
+				future.set_exception(GdbError(token, errmsg))
+			self.command_stats.done(token)
+			self.onError.broadcast(token, errmsg)
 		else:
 			# call custom handler if any
 			self.log.debug("CHECK for token: %s" % repr(token))
-			if self._response_handlers.has_key(token):
+			if handler is not None:
 				self.log.debug("TOKEN FOUND: %s" % repr(token))
-				handler = self._response_handlers[token]
-				def thread_func():
-					handler(results)
-					self._response_handlers.pop(token)
+				def run_handler():
+					try:
+						response = handler(results)
+					except Exception, err:
+						future.set_exception(err)
+						self.command_stats.done(token)
+						raise
+					end = time.time()
+					# waiters first, accounting after
+					future.set_result(response)
+					self.command_stats.done(token, end)
 					self.onProcessed.broadcast()
-				handler_thread = SafeThread(target = thread_func, args = [])
-				handler_thread.setDaemon(True)
-				handler_thread.start()
+				# one lane per session, should the pool be shared
+				self._handlers.submit(self, run_handler)
+			elif future is not None:
+				end = time.time()
+				future.set_result(results)
+				self.command_stats.done(token, end)
 			else:
 				self.log.debug("TOKEN NOT FOUND: %s" % repr(token))
 		
@@ -275,6 +451,18 @@ class GdbSession(object):
 			self._src_line = None
 		self.onFrameChange.broadcast(frame)
 	
+	def close(self):
+		"""
+		End the session : terminate gdb, fail the commands still waiting for a response,
+		stop the session's threads and release its files.
+		"""
+		self.gdb.kill()
+		self._requests.fail_all("gdb session closed")
+		self.controller.close()
+		if self._own_handlers:
+			self._handlers.close()
+		self.gdb.close()
+	
 	def get_watched_var(self, path):
 		return self._vars.get(path, None)
 
@@ -300,6 +488,24 @@ class GdbSession(object):
 		if root in self._watchers:
 			self._watchers.pop(root)
 
+	def batch(self):
+		"""
+		Return a context collecting the commands sent in it, written to gdb at once (see CommandBatch).
+		"""
+		return self.controller.batch()
+
+	def latency_histograms(self):
+		"""
+		Return the latency histograms of the commands answered so far, by verb and phase (see command_stats).
+		"""
+		return self.command_stats.to_dict()
+
+	def events(self, slot, timeout = None):
+		"""
+		Return an iterator over the broadcasts of one of the event slots (see EventIterator).
+		"""
+		return EventIterator(slot, timeout)
+
 	def add_watch(self, expr):
 		var = self.var_create(expr, sync = True)
 		watch = FilteredWatch._wrap(self, var)
@@ -395,6 +601,11 @@ class GdbSession(object):
 		self.controller.set_args(args)
 		def on_response(response):
 			self.onFileChanged.broadcast(filename)
+		if self.gdb.executable is not None and self.gdb.executable == os.path.abspath(filename):
+			# loaded before the session started
+			future = GdbFuture()
+			future.set_result(on_response(None))
+			return future
 		return self.controller.file(filename, on_response=on_response)
 	def attach(self, what):
 		return self.controller.target_attach(what)
@@ -459,16 +670,28 @@ class GdbSession(object):
 					self._update_var(v, upd)
 		return self.controller.var_update(on_response = on_response)
 	def var_list_children(self, name, sync = False):
+		child_futures = []
 		def on_response(response):
 			children = {}
-			for tag,child in response.children:
-				childv = Var(self, name = child.name, expr = child.exp, type = child.get('type', None), value = None, numchild = child.numchild, in_scope = True)
-				children[child.exp] = childv
-				self._vars[childv.name] = childv 
-				self.var_path_expr(child.name, sync = sync)
-				self.var_eval(child.name, sync = sync)
+			with self.batch() as futures:
+				for tag,child in response.children:
+					childv = Var(self, name = child.name, expr = child.exp, type = child.get('type', None), value = None, numchild = child.numchild, in_scope = True)
+					children[child.exp] = childv
+					self._vars[childv.name] = childv
+					self.var_path_expr(child.name)
+					self.var_eval(child.name)
+			child_futures.extend(futures)
 			return children
-		return self.controller.var_list_children(name, on_response = on_response, sync = sync)
+		children = self.controller.var_list_children(name, on_response = on_response, sync = sync)
+		if sync:
+			# the handler must not wait : wait for the children here
+			with self._handlers.blocking():
+				for future in child_futures:
+					error = future.exception(self.controller.SYNC_TIMEOUT)
+					if error is not None:
+						# eg. no path expression for an anonymous union or a base class : the child is listed all the same
+						self.log.warning("VAR LIST CHILDREN %s : request %s failed : %s" % (name, future.token, error))
+		return children
 	def var_eval(self, name, sync = False):
 		def on_response(response):
 			v = self.get_watched_var(name)
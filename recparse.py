@@ -1,24 +1,60 @@
 from __future__ import with_statement
 from collections import deque
+from itertools import islice
 from StringIO import StringIO
+import re
 
 class TokenStream(object):
-	def __init__(self, stream):
+	"""
+	Only the tokens extracted since the last commit() are kept, so that savepoints
+	are positions in the whole stream, but only those after the last commit are valid.
+	
+	If packrat is set, parse results are memoized by (parser, position) for the duration 
+	of the outermost parse over the stream. 
+	This bounds the cost of backtracking, at the expense of memory.
+	It is off by default : the grammars of this package seldom parse the same input twice,
+	so memoizing costs more than it saves on them (gdb output, C++ type names). 
+	It pays off on grammars whose alternatives share long prefixes (see mi_bench.py packrat).
+	"""
+	def __init__(self, stream, packrat = False):
 		self.unconsumed = stream
 		self.extracted = deque()
 		self.nconsumed = 0
+		self.ncommitted = 0
 		self.stopiter = False
+		self.memo = {} if packrat else None
+		self.depth = 0
 
 	def eos(self):
 		return self.stopiter and self.nconsumed == len(self.extracted)
 
 	def savepoint(self):
-		return self.nconsumed
+		return self.ncommitted + self.nconsumed
 
 	def backtrack(self, savepoint):
-		self.nconsumed = savepoint
+		if savepoint < self.ncommitted:
+			raise ValueError("Cannot backtrack to %d : tokens before %d were committed" % (savepoint, self.ncommitted))
+		self.nconsumed = savepoint - self.ncommitted
+
+	def commit(self):
+		"""
+		Discard the consumed tokens. It is no longer possible to backtrack to before this point.
+		Outermost parsers call this once they are done with a part of the input, to run in bounded memory.
+		"""
+		extracted = self.extracted
+		if self.nconsumed == len(extracted):
+			extracted.clear()
+		else:
+			for i in xrange(self.nconsumed):
+				extracted.popleft()
+		self.ncommitted += self.nconsumed
+		self.nconsumed = 0
 
 	def consume(self):
+		"""
+		Consume the next token and return it.
+		Raise StopIteration at the end of the stream.
+		"""
 		if len(self.extracted) > self.nconsumed:
 			tok = self.extracted[self.nconsumed]
 		else:
@@ -26,10 +62,53 @@ class TokenStream(object):
 				tok = self.unconsumed.next()
 			except StopIteration:
 				self.stopiter = True
+				raise
 			self.extracted.append(tok)
 		self.nconsumed += 1
 		return tok
 
+	def peek(self):
+		"""
+		Return the next token without consuming it.
+		Raise StopIteration at the end of the stream.
+		"""
+		if len(self.extracted) == self.nconsumed:
+			try:
+				tok = self.unconsumed.next()
+			except StopIteration:
+				self.stopiter = True
+				raise
+			self.extracted.append(tok)
+		return self.extracted[self.nconsumed]
+
+	def peek_all(self):
+		"""
+		Return the list of the remaining tokens, without consuming them.
+		An error raised by the underlying iterator (eg. a lexer error) is raised, 
+		the tokens read before it are kept.
+		"""
+		extracted = self.extracted
+		if not self.stopiter:
+			for tok in self.unconsumed:
+				extracted.append(tok)
+			self.stopiter = True
+		return list(islice(extracted, self.nconsumed, None))
+
+	def consume_upto(self, n):
+		"""
+		Consume up to n tokens and return them as a list : fewer only at the end of the stream.
+		"""
+		extracted = self.extracted
+		toks = list(islice(extracted, self.nconsumed, min(self.nconsumed + n, len(extracted))))
+		if len(toks) < n and not self.stopiter:
+			rest = list(islice(self.unconsumed, n - len(toks)))
+			if len(toks) + len(rest) < n:
+				self.stopiter = True
+			extracted.extend(rest)
+			toks.extend(rest)
+		self.nconsumed += len(toks)
+		return toks
+
 class Backtracker(object):
 	def __init__(self, stream):
 		self.success = False
@@ -53,8 +132,11 @@ class ParseResult(object):
 class Parser(object):
 
 	result_func = None
+	text_func = None
 
 	def try_parse(self, stream):
+		if stream.memo is not None:
+			return self._try_parse_memo(stream)
 		with Backtracker(stream) as parse_state:
 			success, result = self._try_parse(stream)
 			parse_state.success = success
@@ -62,10 +144,58 @@ class Parser(object):
 			result.apply_func(self.result_func)
 		return success, result
 
+	def _try_parse_memo(self, stream):
+		memo = stream.memo
+		key = (self, stream.savepoint())
+		if key in memo:
+			success, tokens, value, end = memo[key]
+			if not success:
+				return False, None
+			stream.backtrack(end)
+			# callers may modify the result they get : hand out a copy
+			return True, ParseResult(tokens, value)
+		stream.depth += 1
+		try:
+			with Backtracker(stream) as parse_state:
+				success, result = self._try_parse(stream)
+				parse_state.success = success
+			if success and self.result_func is not None:
+				result.apply_func(self.result_func)
+		finally:
+			stream.depth -= 1
+			if stream.depth == 0:
+				# outermost parse is over
+				memo.clear()
+		if not success:
+			if stream.depth > 0:
+				memo[key] = (False, None, None, None)
+			return False, None
+		if stream.depth > 0:
+			memo[key] = (True, result.tokens, result.value, stream.savepoint())
+		return True, ParseResult(result.tokens, result.value)
+
 	def _try_parse(self, stream):
 		raise NotImplementedError
 
+	def _first(self, visiting):
+		"""
+		Return (keys, nullable) : the keys (see token_key) of the tokens a match can start with,
+		and whether the parser can match the empty input.
+		Return None if it cannot be told, in which case any token may start a match.
+		visiting holds the Forward parsers being computed, to cut recursion.
+		"""
+		return None
+
+	def _regex(self, ctx):
+		"""
+		Return a regular expression source matching exactly the input this parser matches,
+		or None if the parser cannot be compiled (see Lexer).
+		Result functions are not taken into account.
+		"""
+		return None
+
 	def set_result(self, func):
+		self.text_func = None
 		if self.result_func is None:
 			self.result_func = func
 		else:
@@ -74,7 +204,16 @@ class Parser(object):
 		return self
 
 	def ignore(self):
-		self.result_func = lambda toks, val: None
+		self.result_func = ignore_result
+		return self
+
+	def set_text_result(self, func):
+		"""
+		Compute the value from the matched characters only : func(text).
+		The compiled Lexer then calls func on the matched text without running the parser.
+		"""
+		self.text_func = func
+		self.result_func = lambda tok, val: func(flatten_chars(tok, val))
 		return self
 
 	def __ge__(self, func):
@@ -147,6 +286,15 @@ class Forward(Parser):
 	def set_result(self, func):
 		self.parser.set_result(func)
 
+	def _first(self, visiting):
+		if self.parser is None or self in visiting:
+			return None
+		visiting.add(self)
+		try:
+			return self.parser._first(visiting)
+		finally:
+			visiting.remove(self)
+
 	def _try_parse(self, stream):
 		if self.parser is None:
 			raise "Forgot to set forwarded parser expression."
@@ -160,55 +308,161 @@ class Terminal(Parser):
 	def _try_parse(self, stream):
 		try:
 			tok = stream.consume()
-		except:
+		except StopIteration:
+			# a lexer error is raised to the caller
 			return False, None
 		if tok == self.tok:
 			return True, ParseResult([tok], tok)
 		else:
 			return False, None
 
+	def _first(self, visiting):
+		return frozenset([ token_key(self.tok) ]), False
+
+	def _regex(self, ctx):
+		if isinstance(self.tok, str) and len(self.tok) == 1:
+			return re.escape(self.tok)
+		return None
+
 class TokenPredicate(Parser):
-	def __init__(self, predicate):
+	"""
+	Matches a single token accepted by the predicate.
+	first, if given, holds the keys of all the tokens the predicate may accept.
+	"""
+	def __init__(self, predicate, first = None):
 		self.accept = predicate
+		self.first = None if first is None else frozenset(first)
 
 	def _try_parse(self, stream):
 		try:
 			tok = stream.consume()
-		except:
+		except StopIteration:
+			# a lexer error is raised to the caller
 			return False, None
 		if self.accept(tok):
 			return True, ParseResult([tok], tok)
 		else:
 			return False, None
 
+	def _first(self, visiting):
+		if self.first is None:
+			return None
+		return self.first, False
+
+class TokenKind(TokenPredicate):
+	"""
+	Matches a (tokname, value) token of the given name, as output by a Lexer.
+	"""
+	def __init__(self, name):
+		self.name = name
+		TokenPredicate.__init__(self, lambda tok: tok[0] == name, first = (name,))
+
+class CharSet(TokenPredicate):
+	"""
+	Matches a single character in (or, if exclude is set, not in) the given set.
+	"""
+	def __init__(self, string, exclude = False):
+		chars = frozenset(string)
+		self.chars = chars
+		self.exclude = exclude
+		if exclude:
+			TokenPredicate.__init__(self, lambda c: c not in chars)
+		else:
+			TokenPredicate.__init__(self, lambda c: c in chars, first = chars)
+
+	def _regex(self, ctx):
+		if len(self.chars) == 0:
+			return '.' if self.exclude else None
+		return '[%s%s]' % ('^' if self.exclude else '', ''.join(re.escape(c) for c in sorted(self.chars)))
+
 def CharacterClass(string):
-	MATCH = set(string)
-	return TokenPredicate(lambda c: c in MATCH)
+	return CharSet(string)
 
 def AnyToken():
-	return TokenPredicate(lambda c: True)
+	return CharSet('', exclude = True)
 
 def ExcludeChars(string):
-	EXCLUDE = set(string)
-	return TokenPredicate(lambda c: c not in EXCLUDE)
+	return CharSet(string, exclude = True)
 
 def Intersect(*tokenpreds):
 	return TokenPredicate(lambda c: all ( P.accept(c) for P in  tokenpreds ))
 
 class Disj(Parser):
+	"""
+	Ordered choice.
+	The options are dispatched on the next token : only those whose FIRST set holds the key 
+	of the token (or that may match the empty input) are tried.
+	"""
 	
+	dispatch = None
+
 	def __init__(self, *options):
 		self.options = options
 
 	def _try_parse(self, stream):
 		success = False
 		result = None
-		for p in self.options:
+		for p in self._candidates(stream):
 			success, result = p.try_parse(stream)
 			if success: 
 				break
 		return success, result
 
+	def _candidates(self, stream):
+		if self.dispatch is None:
+			# built on first use : the grammar is complete by then
+			self.dispatch = self._dispatch_table()
+		table, fallback = self.dispatch
+		if table is None:
+			return self.options
+		try:
+			key = token_key(stream.peek())
+		except StopIteration:
+			# end of stream : let the options fail on their own
+			return self.options
+		try:
+			return table.get(key, fallback)
+		except TypeError:
+			# unhashable token
+			return self.options
+
+	def _dispatch_table(self):
+		"""
+		Return (table, fallback) : table maps token keys to the options that may start with them, 
+		and fallback holds the options that may start with any other token.
+		"""
+		firsts = [ p._first(set()) for p in self.options ]
+		fallback = tuple(p for p, first in zip(self.options, firsts) if first is None or first[1])
+		if len(fallback) == len(self.options):
+			return None, None
+		keys = set()
+		for first in firsts:
+			if first is not None:
+				keys.update(first[0])
+		table = {}
+		for key in keys:
+			table[key] = tuple(p for p, first in zip(self.options, firsts) 
+				if first is None or first[1] or key in first[0])
+		return table, fallback
+
+	def _first(self, visiting):
+		keys = set()
+		nullable = False
+		for p in self.options:
+			first = p._first(visiting)
+			if first is None:
+				return None
+			keys.update(first[0])
+			nullable = nullable or first[1]
+		return frozenset(keys), nullable
+
+	def _regex(self, ctx):
+		options = [ p._regex(ctx) for p in self.options ]
+		if None in options:
+			return None
+		# ordered choice: the first matching option is committed to
+		return ctx.atomic('|'.join(options))
+
 	def __or__(self, other):
 		return Disj(*(self.options + (other,)))
 
@@ -232,6 +486,23 @@ class Seq(Parser):
 		
 		return True, ParseResult(restoks, res)
 
+	def _first(self, visiting):
+		keys = set()
+		for p in self.items:
+			first = p._first(visiting)
+			if first is None:
+				return None
+			keys.update(first[0])
+			if not first[1]:
+				return frozenset(keys), False
+		return frozenset(keys), True
+
+	def _regex(self, ctx):
+		items = [ p._regex(ctx) for p in self.items ]
+		if None in items:
+			return None
+		return ''.join('(?:%s)' % item for item in items)
+
 	def __add__(self, other):
 		if self.result_func is not None:
 			return Parser.__add__(self, other)
@@ -260,6 +531,19 @@ class Repeat(Parser):
 			return False, None
 		return True, ParseResult(restoks, res)
 
+	def _first(self, visiting):
+		first = self.inner._first(visiting)
+		if first is None:
+			return None
+		return first[0], first[1] or not self.min
+
+	def _regex(self, ctx):
+		inner = self.inner._regex(ctx)
+		if inner is None:
+			return None
+		# repetition is greedy and never gives back what it matched
+		return ctx.atomic('(?:%s){%d,%s}' % (inner, self.min or 0, '' if self.max is None else self.max))
+
 def Optional(inner, default_val = None):
 	return Repeat(inner, 0, 1).set_result(lambda tok,val: default_val if len(val) == 0 else val[0])
 
@@ -281,17 +565,86 @@ class Literal(Seq):
 			result.value = ''.join(result.value)
 		return success, result	
 
+	def _regex(self, ctx):
+		if not isinstance(self.literal, str):
+			return None
+		return re.escape(self.literal)
+
 def ascrange(start, end):
 	return ''.join([ chr(i) for i in range(ord(start), ord(end)+1) ])
 
+def token_key(tok):
+	"""
+	The key of a token in FIRST sets : a character, or the name of a lexer token.
+	"""
+	if isinstance(tok, tuple):
+		return tok[0]
+	return tok
+
+def token_value(tok, res):
+	return res[1]
+
+def join_chars(tok, res):
+	return ''.join(res)
+
+def ignore_result(tok, res):
+	return None
+
 def Word(string):
-	return (CharacterClass(string) * (1,)).set_result(lambda tok,res: ''.join(res))
+	return (CharacterClass(string) * (1,)).set_result(join_chars)
+
+class RegexContext(object):
+	"""
+	Allocates the group names needed while compiling parsers to a regular expression.
+	"""
+	def __init__(self):
+		self.ngroups = 0
+
+	def atomic(self, regex):
+		"""
+		Emulate an atomic group: once matched, the regex engine never backtracks into it.
+		This gives regexes the committed-choice semantics of the parsers.
+		"""
+		self.ngroups += 1
+		name = '_g%d' % self.ngroups
+		return '(?=(?P<%s>%s))(?P=%s)' % (name, regex, name)
+
+def _subparsers(parser):
+	if isinstance(parser, Disj):
+		return parser.options
+	elif isinstance(parser, Seq):
+		return parser.items
+	elif isinstance(parser, Repeat):
+		return (parser.inner,)
+	elif isinstance(parser, Group):
+		return (parser.base,)
+	return ()
+
+def _flattens_to_text(parser):
+	"""
+	True if flattening the value of the parser gives back the matched characters.
+	"""
+	if isinstance(parser, Literal):
+		return parser.result_func is None
+	if parser.result_func not in (None, join_chars, flatten_chars):
+		return False
+	return all(_flattens_to_text(p) for p in _subparsers(parser))
 
 class Lexer(object):
+	"""
+	Splits a stream of characters into a stream of (tokname, value) tokens.
+
+	At construction, the token parsers are compiled into a single regular expression 
+	that picks the matching token in one pass.
+	Token values are then computed from the matched text, running the token parser over it 
+	only when its result functions require so.
+	If a token parser cannot be compiled, the lexer falls back to trying each parser in turn.
+	lex_interpreted() always does the latter and can be used to check the compiled lexer.
+	"""
 
 	def __init__(self, **tokens):
 		def token_matcher(name):
-			return TokenPredicate(lambda tok: tok[0] == name).set_result(lambda tok,val: val[1])
+			return TokenKind(name).set_result(token_value)
 		for tokname, tokparser in tokens.iteritems():
 			match_token = token_matcher(tokname)
 			setattr(self, tokname, match_token)
@@ -299,8 +652,118 @@ class Lexer(object):
 		self.tokens = (
 			  [ (tokname, tokparser) for (tokname, tokparser) in tokens.iteritems() if isinstance(tokparser, Literal) ] 
 			+ [ (tokname, tokparser) for (tokname, tokparser) in tokens.iteritems() if not isinstance(tokparser, Literal) ])
-		
+		self.pattern, self.token_values = self._compile()
+
+	def _compile(self):
+		ctx = RegexContext()
+		alternatives = []
+		token_values = {}
+		for tokname, tokparser in self.tokens:
+			regex = tokparser._regex(ctx)
+			if regex is None:
+				return None, None
+			alternatives.append('(?P<%s>%s)' % (tokname, regex))
+			text_func = tokparser.text_func
+			if tokparser.result_func is ignore_result:
+				token_values[tokname] = ignore_result
+			elif text_func is not None and all(_flattens_to_text(p) for p in _subparsers(tokparser)):
+				token_values[tokname] = lambda tok, text, func = text_func: func(text)
+			elif _flattens_to_text(tokparser) and (isinstance(tokparser, Literal) or tokparser.result_func is not None):
+				token_values[tokname] = None # the value is the matched text
+			else:
+				token_values[tokname] = self._interpreted_value(tokparser)
+		try:
+			pattern = re.compile('|'.join(alternatives), re.DOTALL)
+		except (re.error, AssertionError, OverflowError):
+			# eg. too many groups
+			return None, None
+		return pattern, token_values
+
+	def _interpreted_value(self, tokparser):
+		def value(tok, text):
+			success, result = tokparser.try_parse(TokenStream(iter(text)))
+			if not success:
+				raise SyntaxError("Lexer mismatch on %s" % repr(text))
+			return result.value
+		return value
+
+	# characters of input the compiled lexer has read ahead of the token it matches, at least
+	LOOKAHEAD = 1 << 16
+
 	def lex(self, stream):
+		"""
+		stream may be a TokenStream of characters or a string.
+
+		A TokenStream is read LOOKAHEAD characters at a time and committed as it is read :
+		lexing it takes memory for the lookahead and the longest token, not for the whole input.
+		A token is matched once LOOKAHEAD characters past its start are read, and more if it runs
+		to the end of them : the tokens are those of the whole input, unless a token longer than
+		LOOKAHEAD characters starts with a shorter token of another kind.
+		If no token matches there, SyntaxError is raised without reading further, so that a bad
+		input on an endless stream fails at once : that includes a token longer than LOOKAHEAD
+		characters whose start matches no token on its own.
+		"""
+		if self.pattern is None:
+			if isinstance(stream, basestring):
+				stream = TokenStream(iter(stream))
+			return self.lex_interpreted(stream)
+		if isinstance(stream, basestring):
+			return TokenStream(self._lex_text(stream))
+		return TokenStream(self._lex_chunks(stream))
+
+	def _token(self, m):
+		"""
+		Return the token of a match of the pattern, or None if its value is ignored.
+		"""
+		tokname = m.lastgroup
+		value_func = self.token_values[tokname]
+		if value_func is None:
+			return (tokname, m.group())
+		value = value_func(None, m.group())
+		if value is None:
+			return None
+		return (tokname, value)
+
+	def _lex_text(self, text):
+		match = self.pattern.match
+		pos = 0
+		end = len(text)
+		while pos < end:
+			m = match(text, pos)
+			if m is None or m.end() == pos:
+				raise SyntaxError("")
+			pos = m.end()
+			tok = self._token(m)
+			if tok is not None:
+				yield tok
+
+	def _lex_chunks(self, stream):
+		match = self.pattern.match
+		lookahead = self.LOOKAHEAD
+		text = ''
+		pos = 0
+		more = True # characters left in the stream
+		while True:
+			if pos < len(text) and (not more or len(text) - pos > lookahead):
+				m = match(text, pos)
+				if m is None or m.end() == pos:
+					raise SyntaxError("")
+				if not more or m.end() < len(text):
+					pos = m.end()
+					tok = self._token(m)
+					if tok is not None:
+						yield tok
+					continue
+				# a token that may go on past the text read so far
+			elif not more:
+				return
+			chunk = stream.consume_upto(lookahead)
+			stream.commit()
+			more = len(chunk) == lookahead
+			text = text[pos:] + ''.join(chunk)
+			pos = 0
+
+	def lex_interpreted(self, stream):
 		def gen():
 			while True:
 				for tokname, tokparser in self.tokens:
@@ -309,6 +772,8 @@ class Lexer(object):
 						break
 				if not success:
 					break
+				# the lexer never backtracks over a token it has matched
+				stream.commit()
 				if result.value is not None:
 					yield(tokname, result.value)
 			if not stream.eos():
@@ -321,6 +786,12 @@ class Group(Parser):
 		self.result_func = base.result_func
 	def _try_parse(self, stream):
 		return self.base._try_parse(stream)
+
+	def _first(self, visiting):
+		return self.base._first(visiting)
+
+	def _regex(self, ctx):
+		return self.base._regex(ctx)
 	
 
 def DelimitedList(parser, sep):
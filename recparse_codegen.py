@@ -0,0 +1,435 @@
+"""
+Compiles recparse grammars to Python source.
+
+The combinator graph of a finished grammar is turned into one plain function per parser,
+which works on a list of tokens and an index instead of a TokenStream :
+no Backtracker, no ParseResult and no method dispatch per step.
+A failed match returns None, a successful one returns (end, tokens, value),
+so that backtracking is just forgetting the returned position.
+
+The combinator graph remains the source of truth : the generated code only depends on its shape,
+the tokens, predicates and result functions it uses are bound when the code is loaded,
+from the parsers of the grammar listed in a fixed order (see grammar_nodes).
+The compiled code is cached on disk, keyed by a hash of the shape of the grammar and of this generator :
+on a hit, nothing is generated.
+
+	compiled = CompiledParser(grammar)
+	success, result = compiled.try_parse(tokstream)
+
+gives the same results as grammar.try_parse(tokstream).
+"""
+import os
+import re
+import imp
+import marshal
+import hashlib
+
+from recparse import *
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mygdb')
+
+# stands for the end of the token list in dispatch tests
+END = object()
+
+def children(parser):
+	"""
+	Return the parsers the generator may visit from parser.
+	"""
+	if isinstance(parser, Group):
+		return [ parser.base ]
+	if isinstance(parser, Forward):
+		return [] if parser.parser is None else [ parser.parser ]
+	if isinstance(parser, Seq):
+		return list(parser.items)
+	if isinstance(parser, Repeat):
+		return [ parser.inner ]
+	if isinstance(parser, Disj):
+		return list(parser.options)
+	return []
+
+def grammar_nodes(parser):
+	"""
+	Return the parsers of the grammar, depth first from parser : the same grammar always lists them in the same order.
+	"""
+	nodes = []
+	seen = set()
+	stack = [ parser ]
+	while stack:
+		node = stack.pop()
+		if id(node) in seen:
+			continue
+		seen.add(id(node))
+		nodes.append(node)
+		stack.extend(reversed(children(node)))
+	return nodes
+
+def describe(parser, index):
+	"""
+	Return what the generated code of parser depends on, but for the constants it binds.
+	"""
+	func = parser.result_func
+	desc = [ type(parser).__name__, 'none' if func is None else 'value' if func is token_value else 'func' ]
+	desc.append([ index[id(child)] for child in children(parser) ])
+	if isinstance(parser, TokenKind):
+		desc.append(parser.name)
+	if isinstance(parser, CharSet):
+		desc.append(parser.exclude)
+	if isinstance(parser, Literal):
+		desc.append(isinstance(parser.literal, str) and len(parser.literal))
+	if isinstance(parser, Repeat):
+		desc += [ parser.min, parser.max ]
+	if isinstance(parser, Disj):
+		# what the dispatch on the next token is made of
+		firsts = [ option._first(set()) for option in parser.options ]
+		desc.append([ None if first is None else bool(first[1]) for first in firsts ])
+	return repr(desc)
+
+def generator_digest():
+	"""
+	Return a hash of the source of this module, or None if it cannot be read.
+	"""
+	try:
+		f = open(os.path.splitext(__file__)[0] + '.py', 'rb')
+		try:
+			return hashlib.sha1(f.read()).hexdigest()
+		finally:
+			f.close()
+	except IOError:
+		return None
+
+GENERATOR_DIGEST = generator_digest()
+
+def grammar_key(nodes):
+	"""
+	Return the cache key of the code generated for a grammar, or None if there is no telling.
+	"""
+	if GENERATOR_DIGEST is None:
+		return None
+	index = dict((id(node), i) for i, node in enumerate(nodes))
+	digest = hashlib.sha1(GENERATOR_DIGEST)
+	for node in nodes:
+		digest.update(describe(node, index))
+		digest.update('\n')
+	return digest.hexdigest()[:16]
+
+class CodeGenerator(object):
+	"""
+	Generates the functions parsing a grammar.
+	Each parser gets a function applying its result function (like try_parse),
+	and if needed another one that does not (like _try_parse).
+	The constants they use are bound by the generated code itself, from NODES (see grammar_nodes),
+	and ENTRY is the function parsing with the whole grammar.
+	"""
+
+	def __init__(self, nodes):
+		self.index = dict((id(node), i) for i, node in enumerate(nodes))
+		self.names = {}
+		self.queue = []
+		self.functions = []
+		self.bindings = []
+
+	def function(self, parser, full = True):
+		"""
+		Return the name of the function parsing with parser, generating it if needed.
+		"""
+		if parser.result_func is None:
+			full = False
+		if not full and isinstance(parser, Forward) and parser.parser is not None:
+			return self.function(parser.parser)
+		if not full and isinstance(parser, Group):
+			return self.function(parser.base, full = False)
+		key = (id(parser), full)
+		if key not in self.names:
+			self.names[key] = '%s%d' % ('p' if full else 'r', len(self.names))
+			self.queue.append((parser, full, self.names[key]))
+		return self.names[key]
+
+	def constant(self, prefix, parser, expr = '%s'):
+		"""
+		Return the name of a constant bound to expr, where %s stands for parser.
+		"""
+		name = '%s%d' % (prefix, len(self.bindings) + 1)
+		self.bindings.append('%s = %s' % (name, expr % ('NODES[%d]' % self.index[id(parser)])))
+		return name
+
+	def generate(self, parser):
+		"""
+		Return the source of the module parsing with parser.
+		"""
+		entry = self.function(parser)
+		while self.queue:
+			parser, full, name = self.queue.pop()
+			fin = Finisher(self, parser if full else None)
+			lines = [ 'def %s(toks, n, pos):' % name ] + indent(self.body(parser, fin))
+			self.functions.append('\n'.join(lines))
+		return '\n'.join(self.bindings) + '\n\n' + '\n\n'.join(self.functions) + '\n\nENTRY = %s\n' % entry
+
+	def body(self, parser, fin):
+		"""
+		Return the lines of a function parsing with parser but not applying its result function,
+		then passing the match to fin.
+		"""
+		if isinstance(parser, Group):
+			return self.body(parser.base, fin)
+		if is_single(parser):
+			return self.single_body(parser, fin)
+		if isinstance(parser, Literal) and isinstance(parser.literal, str):
+			return self.literal_body(parser, fin)
+		if isinstance(parser, Seq):
+			return self.seq_body(parser, fin)
+		if isinstance(parser, Repeat):
+			return self.repeat_body(parser, fin)
+		if isinstance(parser, Disj):
+			return self.disj_body(parser, fin)
+		if isinstance(parser, Forward) and parser.parser is not None:
+			return self.call('r', self.function(parser.parser), [ 'return None' ]) + fin.match('r')
+		return self.fallback_body(parser, fin)
+
+	def call(self, var, func, on_failure):
+		return [
+			'%s = %s(toks, n, pos)' % (var, func),
+			'if %s is None:' % var,
+		] + indent(on_failure) + [
+			'pos = %s[0]' % var,
+		]
+
+	# ---------- single tokens ----------
+
+	def single_test(self, parser):
+		"""
+		Return the test of a token matched by parser as an expression of 'tok'.
+		"""
+		if isinstance(parser, Terminal):
+			return 'tok == %s' % self.constant('C', parser, '%s.tok')
+		if isinstance(parser, TokenKind):
+			return 'tok[0] == %r' % parser.name
+		if isinstance(parser, CharSet):
+			return 'tok %s %s' % ('not in' if parser.exclude else 'in', self.constant('S', parser, '%s.chars'))
+		return '%s(tok)' % self.constant('A', parser, '%s.accept')
+
+	def single(self, parser, tokvar, valvar, on_failure):
+		"""
+		Lines matching a single token with parser, storing its tokens and value.
+		"""
+		lines = [
+			'if pos >= n:',
+		] + indent(on_failure) + [
+			'tok = toks[pos]',
+			'if not (%s):' % self.single_test(parser),
+		] + indent(on_failure) + [
+			'pos += 1',
+			'%s = [tok]' % tokvar,
+		]
+		if parser.result_func is None:
+			lines.append('%s = tok' % valvar)
+		elif parser.result_func is token_value:
+			lines.append('%s = tok[1]' % valvar)
+		else:
+			lines.append('%s = %s(%s, tok)' % (valvar, self.constant('F', parser, '%s.result_func'), tokvar))
+		return lines
+
+	def single_body(self, parser, fin):
+		lines = [
+			'if pos >= n:',
+			'	return None',
+			'tok = toks[pos]',
+			'if not (%s):' % self.single_test(parser),
+			'	return None',
+			'pos += 1',
+		]
+		return lines + fin('[tok]', 'tok')
+
+	def match(self, parser, tokvar, valvar, on_failure):
+		"""
+		Lines matching parser (applying its result function), storing its tokens and value.
+		"""
+		if is_single(parser):
+			return self.single(parser, tokvar, valvar, on_failure)
+		return self.call('r', self.function(parser), on_failure) + [
+			'%s = r[1]' % tokvar,
+			'%s = r[2]' % valvar,
+		]
+
+	# ---------- combinators ----------
+
+	def literal_body(self, parser, fin):
+		size = len(parser.literal)
+		chars = self.constant('L', parser, 'list(%s.literal)')
+		return [
+			'seg = toks[pos:pos + %d]' % size,
+			'if seg != %s:' % chars,
+			'	return None',
+			'pos += %d' % size,
+		] + fin('[ [ tok ] for tok in seg ]', "''.join(seg)")
+
+	def seq_body(self, parser, fin):
+		lines = []
+		for i, item in enumerate(parser.items):
+			lines += self.match(item, 't%d' % i, 'v%d' % i, [ 'return None' ])
+		toks = '[%s]' % ', '.join('t%d' % i for i in xrange(len(parser.items)))
+		vals = '[%s]' % ', '.join('v%d' % i for i in xrange(len(parser.items)))
+		if isinstance(parser, Literal):
+			vals = "''.join(%s)" % vals
+		return lines + fin(toks, vals)
+
+	def repeat_body(self, parser, fin):
+		lines = [
+			'res = []',
+			'restoks = []',
+		]
+		if parser.max is None:
+			lines.append('while True:')
+		else:
+			lines.append('while len(res) < %d:' % parser.max)
+		lines += indent(self.match(parser.inner, 'ti', 'vi', [ 'break' ]) + [
+			'restoks.append(ti)',
+			'res.append(vi)',
+		])
+		if parser.min:
+			lines += [
+				'if len(res) < %d:' % parser.min,
+				'	return None',
+			]
+		return lines + fin('restoks', 'res')
+
+	def disj_body(self, parser, fin):
+		firsts = [ p._first(set()) for p in parser.options ]
+		dispatch = any(first is not None and not first[1] for first in firsts)
+		lines = []
+		if dispatch:
+			lines += [
+				'k = toks[pos] if pos < n else END',
+				'if isinstance(k, tuple):',
+				'	k = k[0]',
+			]
+		for p, first in zip(parser.options, firsts):
+			option = [ 'r = %s(toks, n, pos)' % self.function(p), 'if r is not None:' ] + indent(fin.match('r'))
+			if dispatch and first is not None and not first[1]:
+				# the option can only match if the next token starts it
+				option = [ 'if k in %s:' % self.constant('K', p, '%s._first(set())[0]') ] + indent(option)
+			lines += option
+		return lines + [ 'return None' ]
+
+	def fallback_body(self, parser, fin):
+		"""
+		Run the parser itself on what remains of the tokens.
+		"""
+		name = self.constant('P', parser)
+		return [
+			'stream = TokenStream(iter(toks[pos:]))',
+			'success, result = %s._try_parse(stream)' % name,
+			'if not success:',
+			'	return None',
+			'pos += stream.savepoint()',
+		] + fin('result.tokens', 'result.value')
+
+class Finisher(object):
+	"""
+	Builds the lines returning a successful match, applying the result function of parser if any.
+	"""
+	def __init__(self, gen, parser):
+		self.func = None if parser is None else gen.constant('F', parser, '%s.result_func')
+
+	def __call__(self, toks, val):
+		"""
+		Return the match of the given tokens and value expressions, ending at pos.
+		"""
+		if self.func is None:
+			return [ 'return pos, %s, %s' % (toks, val) ]
+		return [ 't = %s' % toks, 'return pos, t, %s(t, %s)' % (self.func, val) ]
+
+	def match(self, var):
+		"""
+		Return the match held in var.
+		"""
+		if self.func is None:
+			return [ 'return %s' % var ]
+		return [ 'return %s[0], %s[1], %s(%s[1], %s[2])' % (var, var, self.func, var, var) ]
+
+def is_single(parser):
+	"""
+	True if parser matches a single token, with a test the generator knows.
+	"""
+	return isinstance(parser, (Terminal, TokenKind, CharSet)) or type(parser) is TokenPredicate
+
+def indent(lines):
+	return [ '\t' + line for line in lines ]
+
+def load_code(nodes, name, cache_dir = CACHE_DIR):
+	"""
+	Return the code object parsing with the grammar listed in nodes (see grammar_nodes),
+	reading it from the cache directory when it was generated before.
+	Writing a new cache file removes those of the former versions of the grammar.
+	"""
+	key = grammar_key(nodes)
+	if key is not None:
+		codefile = os.path.join(cache_dir, 'recparse_%s_%s.code' % (name, key))
+		magic = imp.get_magic()
+		try:
+			f = open(codefile, 'rb')
+			try:
+				data = f.read()
+			finally:
+				f.close()
+			if data.startswith(magic):
+				return marshal.loads(data[len(magic):])
+		except (IOError, EOFError, ValueError, TypeError):
+			# no cache file, or an unreadable one : generate the code again
+			pass
+	source = CodeGenerator(nodes).generate(nodes[0])
+	code = compile(source, '<recparse %s>' % name, 'exec')
+	if key is None:
+		return code
+	try:
+		if not os.path.isdir(cache_dir):
+			os.makedirs(cache_dir)
+		# write to a private file first, so that concurrent readers never see half a code object
+		tmpfile = "%s.%d.tmp" % (codefile, os.getpid())
+		f = open(tmpfile, 'wb')
+		try:
+			f.write(magic + marshal.dumps(code))
+		finally:
+			f.close()
+		os.rename(tmpfile, codefile)
+		stale = re.compile(r'recparse_%s_[0-9a-f]{16}\.code$' % re.escape(name))
+		for filename in os.listdir(cache_dir):
+			if stale.match(filename) and filename != os.path.basename(codefile):
+				try:
+					os.remove(os.path.join(cache_dir, filename))
+				except OSError:
+					pass
+	except (IOError, OSError):
+		# no cache
+		pass
+	return code
+
+class CompiledParser(object):
+	"""
+	A parser running the code generated for a recparse grammar.
+	It reads all the remaining tokens of the stream up front, so it is meant for bounded inputs (eg. a line) ;
+	a lexer error in them is raised, even if it comes after the part the grammar would match.
+	Tokens must be hashable.
+	"""
+	def __init__(self, parser, name = 'parser', cache_dir = CACHE_DIR):
+		self.parser = parser
+		self.nodes = grammar_nodes(parser)
+		code = load_code(self.nodes, name, cache_dir)
+		namespace = { 'NODES': self.nodes, 'END': END, 'TokenStream': TokenStream }
+		exec code in namespace
+		self.entry = namespace['ENTRY']
+
+	@property
+	def source(self):
+		"""
+		The generated source, generated again.
+		"""
+		return CodeGenerator(self.nodes).generate(self.parser)
+
+	def try_parse(self, stream):
+		toks = stream.peek_all()
+		match = self.entry(toks, len(toks), 0)
+		if match is None:
+			return False, None
+		end, tokens, value = match
+		stream.backtrack(stream.savepoint() + end)
+		return True, ParseResult(tokens, value)
@@ -4,7 +4,7 @@ import pygdb
 from event import EventSlot, EventQueue
 import piped_event
 from curses_mvc import View, TopLevelView, Controller, KeyboardController, KeyboardActions, BubblingKeyboardController
-from curses_mvc_widgets import NamedPanel, LayoutView, CommandPanel, LogView
+from curses_mvc_widgets import NamedPanel, LayoutView, CommandPanel, LogView, HistoryView
 
 import sys
 import os
@@ -319,17 +319,29 @@ class PyGdbTui(TopLevelView):
 		
 		self.log_view = LogView()
 		self.log_view.addLog(logging.getLogger('gdb'), curses_format = self.settings.attr('DEFAULT'))
-		self.log_view.addLog(logging.getLogger('gdbout'), curses_format = self.settings.attr('LOG_GDBOUT'))
 		self.log_view.addLog(logging.getLogger('gdbin'), curses_format = self.settings.attr('LOG_GDBIN'))
 		self.log_view.addLog(logging.getLogger('gdberr'), curses_format = self.settings.attr('LOG_GDBERR'))
-		self.log_view.addLog(logging.getLogger('targetout'), curses_format = self.settings.attr('LOG_TARGETOUT'))
+
+		# gdb and target output, read back from the controller's histories
+		controller = self.sess.controller
+		self.gdbout_panel = NamedPanel("gdb output")
+		self.gdbout_panel.set_inner(HistoryView(controller.output_hist, self.settings.attr('LOG_GDBOUT')))
+		self.targetout_panel = NamedPanel("target output")
+		self.targetout_panel.set_inner(HistoryView(controller.target_hist, self.settings.attr('LOG_TARGETOUT')))
+
+		lower_layout = LayoutView(None, None, 'H')
+		lower_layout.layout(
+			(-.4, self.log_view),
+			(-.3, self.gdbout_panel),
+			(-.3, self.targetout_panel)
+		)
 
 		self.command_panel = CommandPanel()
 	
 		self.layout = LayoutView(self, self.topwin, 'V')
 		self.layout.layout( 
 			(-.65, upper_layout),
-			(-.35, self.log_view),
+			(-.35, lower_layout),
 			(   1, self.command_panel ) 
 		)
 		self.toplevel_kb = TopLevelKeyboardInput(self, self.topwin)
@@ -349,6 +361,7 @@ class PyGdbTui(TopLevelView):
 		
 		# Event Handlers
 		self.sess.onProcessed.subscribe(self.onGdbProcessedResponse)
+		self.sess.eventTargetOutput.subscribe(self.onTargetOutput)
 		#self.scheduled_onGdbProcessedResponse = self.commandHandler.commandQueue.schedule_handler(self._onGdbProcessedResponse)
 		
 	def onGdbProcessedResponse(self):
@@ -358,6 +371,10 @@ class PyGdbTui(TopLevelView):
 		self.update()
 		self.refresh()
 
+	def onTargetOutput(self, block):
+		self.update()
+		self.refresh()
+
 	def handleResize(self):
 		self.layout.resize()
 
@@ -1,5 +1,6 @@
 import pygdb
 from recparse import *
+from recparse_codegen import CompiledParser
 
 class PathParser(object):
 	"""
@@ -86,18 +87,31 @@ class VarPathSyntax(object):
 	named_atom = atom + Optional( lex.LSQUARE + lex.ID + lex.RSQUARE >= (lambda toks, val: val[1]))
 
 	path << DelimitedList(named_atom, lex.DOT)
+
+	compiled_path = CompiledParser(path, 'var_path')
+
+def parse_var_path(inputstr):
+	"""
+	Return the result of parsing a whole var path ; raise SyntaxError if it does not parse.
+	"""
+	tokens = VarPathSyntax.lex.lex(inputstr)
+	success, result = VarPathSyntax.compiled_path.try_parse(tokens)
+	if success and tokens.eos():
+		return result
+	else:
+		raise SyntaxError("invalid var path : %s" % inputstr)
 	
 if __name__ == '__main__':
-	inputstr = 'foo.123.(zob.baz.%d[index])+'
-	chars = TokenStream(iter(inputstr))
-
-	tokens = VarPathSyntax.lex.lex(chars)
-	toks = list(tokens.unconsumed)
-	print toks
-	tokstream = TokenStream(iter(toks))
-
-	success, result = VarPathSyntax.path.try_parse(tokstream)
-	print success
-	if success:
-		print result.tokens
-		print result.value
+
+	import sys
+
+	if len(sys.argv) > 1:
+		inputstr = sys.argv[1]
+	else:
+		inputstr = 'foo.123.(zob.baz.%d[index])+'
+	print inputstr
+
+	result = parse_var_path(inputstr)
+
+	print result.tokens
+	print result.value